@@ -1,5 +1,7 @@
-from flask import Flask, render_template, request, send_from_directory, redirect, url_for, after_this_request
+from flask import Flask, render_template, request, send_from_directory, redirect, url_for, after_this_request, g
 import os
+import shutil
+import logging
 from io import BytesIO
 from PIL import Image
 import fitz
@@ -7,31 +9,58 @@ import json
 import numpy as np
 from datetime import datetime
 from flask import render_template_string
-from flask import Flask, request, send_file, jsonify, make_response
+from flask import Flask, request, send_file, jsonify, make_response, Response, stream_with_context
 import markdown
 import yaml
 import re
 import csv
 from functools import wraps
 import time
+import uuid
 from flask_compress import Compress
 
-from src.invert_color import invert_pdf_colors, remove_pages
-from src.extract_data import extract_data_from_pdf
+from src.invert_color import invert_pdf_colors, remove_pages, INVERT_MODES
+from src.customize_color import customize_pdf_colors, hex_to_rgb
+from src.extract_data import extract_data_from_pdf, extract_data_with_error
+from src import metrics, profiling
+from src import chunked_upload
+from src.pdf_output import save_pdf, SAVE_PRESETS
+from src.redact import redact_document
+from src.operations import validate_operation
+from src.document_pool import DocumentPool
+from src.pipeline import plan_pipeline, run_pipeline
+from src.batch_output import StreamingCsvWriter, jsonl_record, sse_event, batch_event
+from src.thumbnails import get_page_sizes, render_thumbnail
+from src.scheduler import scheduler, estimate_render_cost, estimate_document_cost, estimate_open_document_render_cost, AdmissionRejected
 
 app = Flask(__name__, static_folder='static')
 Compress(app)  # Enable compression properly using Flask-Compress
+# Compressing a streamed response buffers it completely, which defeats streaming
+app.config['COMPRESS_STREAMS'] = False
 
 # Configure upload and processed directories
 UPLOAD_FOLDER = '/tmp/uploads'
 PROCESSED_FOLDER = '/tmp/processed'
+CHUNKED_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'chunked')
+SESSION_FOLDER = os.path.join(UPLOAD_FOLDER, 'sessions')
+# Uploads that /pages, /thumbnail and /apply-redactions may read, each under a random token
+PREVIEW_FOLDER = os.path.join(UPLOAD_FOLDER, 'preview')
+PREVIEW_EXPIRY_SECONDS = 24 * 60 * 60
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+os.makedirs(CHUNKED_UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(PREVIEW_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 16MB max file size
 
+# Open documents for multi-step edit sessions, pooled per worker
+document_pool = DocumentPool(SESSION_FOLDER, scheduler=scheduler)
+
+# Structured request logs (one JSON line per request) go through app.logger
+app.logger.setLevel(logging.INFO)
+
 # Cache control for static assets
 def cache_control(max_age):
     def decorator(f):
@@ -74,9 +103,11 @@ def remove():
         output_filename = f"processed_{file.filename}"
         output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
 
-        file.save(input_path)
+        with metrics.stage("upload_save", "remove"):
+            file.save(input_path)
 
-        remove_pages(input_path, output_path, pages)
+        with scheduler.admit(estimate_document_cost(os.path.getsize(input_path)), 'remove'):
+            remove_pages(input_path, output_path, pages)
 
         return redirect(url_for('download_file', filename=output_filename))
     else:
@@ -95,10 +126,18 @@ def upload_file():
         output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
 
         # Save the uploaded file
-        file.save(input_path)
+        with metrics.stage("upload_save", "invert"):
+            file.save(input_path)
 
-        # Process the file
-        invert_pdf_colors(input_path, output_path)
+        # "auto" only inverts pages that are detected as dark
+        mode = request.form.get('mode', 'all')
+        if mode not in INVERT_MODES:
+            mode = 'all'
+
+        # Estimate the render cost up front and wait for capacity
+        with scheduler.admit(estimate_render_cost(input_path), 'invert'):
+            # Process the file
+            invert_pdf_colors(input_path, output_path, mode=mode)
 
         return redirect(url_for('download_file', filename=output_filename))
     else:
@@ -118,6 +157,260 @@ def download_file(filename):
 
     return send_from_directory(app.config['PROCESSED_FOLDER'], filename, as_attachment=True)
 
+# Chunked, resumable uploads: init -> PUT chunks (any order, retryable) -> complete
+@app.route('/uploads', methods=['POST'])
+def init_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        meta = chunked_upload.create_upload(
+            CHUNKED_UPLOAD_FOLDER,
+            data.get('filename'),
+            data.get('size'),
+            data.get('chunk_size', chunked_upload.DEFAULT_CHUNK_SIZE),
+            max_size=app.config['MAX_CONTENT_LENGTH'],
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'upload_id': meta['upload_id'],
+        'chunk_size': meta['chunk_size'],
+        'chunk_count': meta['chunk_count'],
+    })
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Lets a client resume by telling it which chunks already arrived"""
+    try:
+        meta = chunked_upload.load_upload(CHUNKED_UPLOAD_FOLDER, upload_id)
+        if meta is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        received = chunked_upload.received_chunks(CHUNKED_UPLOAD_FOLDER, upload_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'filename': meta['filename'],
+        'chunk_size': meta['chunk_size'],
+        'chunk_count': meta['chunk_count'],
+        'received': received,
+    })
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    try:
+        with metrics.stage("upload_save", "chunked_upload"):
+            chunked_upload.write_chunk(
+                CHUNKED_UPLOAD_FOLDER, upload_id, index, request.stream,
+                sha256=request.headers.get('X-Chunk-SHA256'),
+            )
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'success': True, 'index': index})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Assemble the upload and optionally run an operation on it.
+
+    Without an operation the file is kept under a random token, which /pages,
+    /thumbnail and /apply-redactions accept like a /upload-for-redaction upload.
+    """
+    data = request.get_json(silent=True) or {}
+    operation = data.get('operation')
+    if operation not in (None, 'invert', 'remove', 'extract'):
+        return jsonify({'error': 'Unsupported operation'}), 400
+    # Check parameters before finalizing, which removes the upload session
+    if operation == 'remove':
+        try:
+            validate_operation(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    fields_to_extract = data.get('fields') or None
+    if fields_to_extract is not None and (
+        not isinstance(fields_to_extract, list) or not all(isinstance(field, str) for field in fields_to_extract)
+    ):
+        return jsonify({'error': 'fields must be a list of field names'}), 400
+
+    token, preview_dir = new_preview_dir()
+    try:
+        input_path = chunked_upload.finalize_upload(CHUNKED_UPLOAD_FOLDER, upload_id, preview_dir)
+    except (LookupError, ValueError) as e:
+        shutil.rmtree(preview_dir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 404 if isinstance(e, LookupError) else 400
+
+    if operation is None:
+        return jsonify({'success': True, 'filename': token})
+
+    try:
+        if operation == 'extract':
+            result = extract_data_from_pdf(input_path, fields_to_extract)
+            return jsonify({'success': True, 'data': result})
+
+        output_filename = f"processed_{os.path.basename(input_path)}"
+        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+        if operation == 'invert':
+            mode = data.get('mode', 'all')
+            if mode not in INVERT_MODES:
+                mode = 'all'
+            with scheduler.admit(estimate_render_cost(input_path), 'invert'):
+                inverted = invert_pdf_colors(input_path, output_path, mode=mode)
+            if not inverted:
+                return jsonify({'error': 'Could not invert the PDF'}), 500
+        else:
+            with scheduler.admit(estimate_document_cost(os.path.getsize(input_path)), 'remove'):
+                remove_pages(input_path, output_path, str(data['pages']))
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Only uploads kept for previews stay on disk
+        shutil.rmtree(preview_dir, ignore_errors=True)
+
+    return jsonify({'success': True, 'download_url': url_for('download_file', filename=output_filename)})
+
+# Document sessions: upload once, apply several operations in memory, save once
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+
+    file = request.files['file']
+    if file.filename == '' or not file.filename.lower().endswith('.pdf'):
+        return jsonify({'error': 'File must be a PDF'}), 400
+
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], f"session_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.pdf")
+    with metrics.stage("upload_save", "session"):
+        file.save(upload_path)
+
+    session_id = document_pool.create(upload_path, os.path.basename(file.filename))
+    try:
+        with document_pool.checkout(session_id) as session:
+            page_count = session.doc.page_count
+    except Exception as e:
+        document_pool.delete(session_id)
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'success': True, 'session_id': session_id, 'page_count': page_count})
+
+@app.route('/sessions/<session_id>/operations', methods=['POST'])
+def session_operation(session_id):
+    op = request.get_json(silent=True) or {}
+    try:
+        validate_operation(op)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with document_pool.checkout(session_id) as session:
+            if op['operation'] == 'invert':
+                cost = estimate_open_document_render_cost(session.doc, os.path.getsize(session.original_path))
+                with scheduler.admit(cost, 'invert'):
+                    document_pool.apply(session, op)
+            else:
+                document_pool.apply(session, op)
+            page_count = session.doc.page_count
+            operation_count = session.applied
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'success': True, 'page_count': page_count, 'operations': operation_count})
+
+@app.route('/sessions/<session_id>/save', methods=['POST'])
+def save_session(session_id):
+    """Write the session's current document once, after all operations"""
+    data = request.get_json(silent=True) or {}
+    preset = data.get('preset')
+    if preset is not None and preset not in SAVE_PRESETS:
+        return jsonify({'error': f"Unknown preset, expected one of: {', '.join(SAVE_PRESETS)}"}), 400
+    try:
+        filename = document_pool.filename(session_id)
+        output_filename = f"processed_{filename}"
+        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+        with document_pool.checkout(session_id) as session:
+            with metrics.stage("save", "session"):
+                save_pdf(session.doc, output_path, preset, keep_document=True)
+    except (LookupError, FileNotFoundError):
+        return jsonify({'error': 'Session not found'}), 404
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'success': True, 'download_url': url_for('download_file', filename=output_filename)})
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    try:
+        document_pool.delete(session_id)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'success': True})
+
+@app.route('/pipeline', methods=['POST'])
+def pipeline():
+    """Run an ordered list of operations on one or more PDFs with a single save.
+
+    Form fields: 'file' or 'files[]' (merged in order) and 'operations', a JSON
+    list such as [{"operation": "remove", "pages": "3-5"}, {"operation": "invert"}].
+    """
+    files = request.files.getlist('files[]') or request.files.getlist('file')
+    if not files or files[0].filename == '':
+        return jsonify({'error': 'No files selected'}), 400
+    for file in files:
+        if not file.filename.lower().endswith('.pdf'):
+            return jsonify({'error': 'All files must be PDFs'}), 400
+
+    try:
+        operations = json.loads(request.form.get('operations', '[]'))
+        if not isinstance(operations, list):
+            raise ValueError('Operations must be a list')
+        steps, _ = plan_pipeline(operations)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid operations: {e}'}), 400
+
+    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"pipeline_{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
+    os.makedirs(temp_dir, exist_ok=True)
+    input_paths = []
+    for index, file in enumerate(files):
+        temp_path = os.path.join(temp_dir, f"{index}_{os.path.basename(file.filename)}")
+        with metrics.stage("upload_save", "pipeline"):
+            file.save(temp_path)
+        input_paths.append(temp_path)
+
+    output_filename = f"processed_{os.path.basename(files[0].filename)}"
+    output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+    try:
+        if any(step['operation'] == 'invert' for step in steps):
+            cost = estimate_render_cost(input_paths[0])
+            cost = cost._replace(memory_bytes=cost.memory_bytes + sum(os.path.getsize(p) for p in input_paths[1:]) * 3)
+        else:
+            cost = estimate_document_cost(sum(os.path.getsize(p) for p in input_paths))
+        with scheduler.admit(cost, 'pipeline'):
+            steps = run_pipeline(input_paths[0], output_path, operations, extra_pdf_paths=input_paths[1:])
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return jsonify({
+        'success': True,
+        'filename': output_filename,
+        'download_url': url_for('download_file', filename=output_filename),
+        'steps': [step['operation'] for step in steps],
+    })
+
 @app.route('/blog')
 def blog_index():
     with open('content/blog/posts.yaml', 'r') as file:
@@ -153,9 +446,11 @@ def upload_for_redaction():
         return jsonify({'error': 'No file selected'}), 400
     
     if file:
-        filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(filename)
-        return jsonify({'success': True, 'filename': file.filename})
+        token, preview_dir = new_preview_dir()
+        with metrics.stage("upload_save", "redact"):
+            file.save(os.path.join(preview_dir, preview_filename(file.filename)))
+        # The token is the only way to refer to this upload later
+        return jsonify({'success': True, 'filename': token})
 
 @app.route('/apply-redactions', methods=['POST'])
 def apply_redactions():
@@ -166,31 +461,101 @@ def apply_redactions():
     if not filename or not redactions:
         return jsonify({'error': 'Missing filename or redactions'}), 400
     
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    output_filename = f"redacted_{filename}"
+    input_path = uploaded_pdf_path(filename)
+    if input_path is None:
+        return jsonify({'error': 'File not found'}), 404
+    output_filename = f"redacted_{os.path.basename(input_path)}"
     output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
     
-    try:
-        doc = fitz.open(input_path)
+    input_size = os.path.getsize(input_path)
+    with scheduler.admit(estimate_document_cost(input_size), 'redact'):
+        try:
+            with metrics.stage("open", "redact"):
+                doc = fitz.open(input_path)
         
-        # Apply redactions to each page
-        for redaction in redactions:
-            page_num = redaction['page']
-            x0, y0 = redaction['x'], redaction['y']
-            x1, y1 = x0 + redaction['width'], y0 + redaction['height']
-            
-            if 0 <= page_num < doc.page_count:
-                page = doc[page_num]
-                page.add_redact_annot((x0, y0, x1, y1), fill=(0, 0, 0))
-                page.apply_redactions()
+            # Apply redactions to each page
+            redact_document(doc, redactions)
         
-        doc.save(output_path)
-        doc.close()
+            with metrics.stage("save", "redact"):
+                save_pdf(doc, output_path)
+            doc.close()
         
-        return jsonify({'success': True, 'redacted_filename': output_filename})
+            return jsonify({'success': True, 'redacted_filename': output_filename})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+def preview_filename(filename):
+    """Client file name reduced to a safe base name, kept for naming the output"""
+    name = os.path.basename(filename or '')
+    return name if name.lower().endswith('.pdf') else 'document.pdf'
+
+def new_preview_dir():
+    """Create a directory under a random token for an upload that previews and redactions refer to"""
+    cleanup_expired_previews()
+    token = uuid.uuid4().hex
+    preview_dir = os.path.join(PREVIEW_FOLDER, token)
+    os.makedirs(preview_dir)
+    return token, preview_dir
+
+def cleanup_expired_previews():
+    cutoff = time.time() - PREVIEW_EXPIRY_SECONDS
+    for name in os.listdir(PREVIEW_FOLDER):
+        path = os.path.join(PREVIEW_FOLDER, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def uploaded_pdf_path(token):
+    """Resolve the PDF uploaded under a preview token, or return None if it is not available"""
+    if not re.fullmatch(r'[0-9a-f]{32}', token or ''):
+        return None
+    preview_dir = os.path.join(PREVIEW_FOLDER, token)
+    try:
+        names = [name for name in os.listdir(preview_dir) if name.lower().endswith('.pdf')]
+    except OSError:
+        return None
+    return os.path.join(preview_dir, names[0]) if names else None
+
+@app.route('/pages/<filename>')
+def page_list(filename):
+    """List page sizes and thumbnail URLs for a range of pages (0-based, inclusive)"""
+    path = uploaded_pdf_path(filename)
+    if path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    start = request.args.get('start', 0, type=int)
+    end = request.args.get('end', None, type=int)
+    try:
+        page_count, pages = get_page_sizes(path, start, end)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    for page in pages:
+        page['thumbnail'] = url_for('page_thumbnail', filename=filename, page_num=page['page'])
+    return jsonify({'success': True, 'page_count': page_count, 'pages': pages})
+
+@app.route('/thumbnail/<filename>/<int:page_num>')
+def page_thumbnail(filename, page_num):
+    """Render one page as PNG; clients fetch a small width first, then the full width"""
+    path = uploaded_pdf_path(filename)
+    if path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    width = request.args.get('width', 200, type=int)
+    try:
+        png = render_thumbnail(path, page_num, width)
+    except IndexError:
+        return jsonify({'error': 'Page not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    response = make_response(png)
+    response.headers['Content-Type'] = 'image/png'
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
 @app.route('/merge-pdf')
 def merge_pdf_page():
     return render_template('merge.html')
@@ -209,38 +574,48 @@ def merge_pdfs():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'All files must be PDFs'}), 400
     
+    temp_files = []
     try:
-        # Create a new PDF document
-        merged_doc = fitz.open()
-        
-        # Save each file temporarily and add to the merged document
-        temp_files = []
+        # Save each file temporarily; admission is based on what actually arrived
         for file in files:
             temp_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(temp_path)
+            with metrics.stage("upload_save", "merge"):
+                file.save(temp_path)
             temp_files.append(temp_path)
-            
-            # Open the PDF and append all pages to the merged document
-            pdf_doc = fitz.open(temp_path)
-            merged_doc.insert_pdf(pdf_doc)
-            pdf_doc.close()
-        
-        # Save the merged document
-        output_filename = f"merged_pdf_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-        merged_doc.save(output_path)
-        merged_doc.close()
-        
+
+        input_size = sum(os.path.getsize(temp_file) for temp_file in temp_files)
+        with scheduler.admit(estimate_document_cost(input_size), 'merge'):
+            # Create a new PDF document
+            merged_doc = fitz.open()
+
+            # Add all pages of each file to the merged document
+            for temp_path in temp_files:
+                with metrics.stage("open", "merge"):
+                    pdf_doc = fitz.open(temp_path)
+                with metrics.stage("insert", "merge"):
+                    merged_doc.insert_pdf(pdf_doc)
+                metrics.increment("pdf_pages_processed_total", pdf_doc.page_count, operation="merge")
+                pdf_doc.close()
+
+            # Save the merged document
+            output_filename = f"merged_pdf_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
+            output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+            with metrics.stage("save", "merge"):
+                save_pdf(merged_doc, output_path)
+            merged_doc.close()
+
+        return jsonify({'success': True, 'merged_filename': output_filename})
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
         # Clean up temporary files
         for temp_file in temp_files:
             try:
                 os.remove(temp_file)
             except:
                 pass
-        
-        return jsonify({'success': True, 'merged_filename': output_filename})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
 
 @app.route('/customize-colors')
 def customize_colors_page():
@@ -262,119 +637,83 @@ def customize_pdf():
     bg_color = request.form.get('bg_color', '#000000')
     text_color = request.form.get('text_color', '#ffffff')
     
-    # Validate hex color format
-    hex_pattern = re.compile(r'^#(?:[0-9a-fA-F]{3}){1,2}$')
-    if not hex_pattern.match(bg_color) or not hex_pattern.match(text_color):
+    # Validate hex color format and convert to RGB tuples
+    try:
+        bg_rgb = hex_to_rgb(bg_color)
+        text_rgb = hex_to_rgb(text_color)
+    except ValueError:
         return jsonify({'error': 'Invalid color format'}), 400
     
+    # Save the uploaded file; admission is based on its size on disk
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
     try:
-        # Convert hex colors to RGB tuples
-        bg_rgb = tuple(int(bg_color.lstrip('#')[i:i+2], 16) / 255 for i in (0, 2, 4))
-        text_rgb = tuple(int(text_color.lstrip('#')[i:i+2], 16) / 255 for i in (0, 2, 4))
-                
-        # Save the uploaded file
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(input_path)
-        
+        with metrics.stage("upload_save", "customize"):
+            file.save(input_path)
+
         # Create output filename
         output_filename = f"customized_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
         output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-        
-        # Open the PDF
-        doc = fitz.open(input_path)
-        
-        # Process each page
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Create a rectangle covering the entire page
-            rect = page.rect
-            
-            # Add a colored background
-            page.draw_rect(rect, color=bg_rgb, fill=bg_rgb)
-            
-            # Get the text
-            text_blocks = page.get_text("dict")["blocks"]
-            
-            # Define a list of fallback fonts that should be available in PyMuPDF
-            fallback_fonts = ["helvetica", "times-roman", "courier"]
-            
-            # Draw text in the specified color
-            for block in text_blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            # Extract text and position
-                            text = span["text"]
-                            origin = fitz.Point(span["origin"])
-                            font_size = span["size"]
-                            
-                            # Try to use a fallback font instead of the original
-                            # This avoids the "need font file or buffer" error
-                            try:
-                                # First try with helvetica as a safe default
-                                page.insert_text(
-                                    origin,
-                                    text,
-                                    fontsize=font_size,
-                                    fontname="helvetica",
-                                    color=text_rgb
-                                )
-                            except Exception as font_error:
-                                # If that fails, try other fallback fonts
-                                success = False
-                                for font in fallback_fonts:
-                                    if font == "helvetica":  # Already tried
-                                        continue
-                                    try:
-                                        page.insert_text(
-                                            origin,
-                                            text,
-                                            fontsize=font_size,
-                                            fontname=font,
-                                            color=text_rgb
-                                        )
-                                        success = True
-                                        break
-                                    except:
-                                        continue
-                                
-                                # If all fallbacks fail, log the error but continue processing
-                                if not success:
-                                    print(f"Could not render text: {text}")
-        
-        # Save the modified PDF
-        print("Saving the modified PDF")
-        doc.save(output_path)
-        doc.close()
-        
+
+        with scheduler.admit(estimate_document_cost(os.path.getsize(input_path)), 'customize'):
+            customize_pdf_colors(input_path, output_path, bg_rgb, text_rgb)
+
+        return jsonify({'success': True, 'filename': output_filename})
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
         # Clean up the input file
         try:
             os.remove(input_path)
         except:
             pass
-        
-        return jsonify({'success': True, 'filename': output_filename})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
 
 @app.route('/extract-data', methods=['GET'])
 def extract_data_page():
     return render_template('extract-data.html')
 
-@app.route('/extract-batch', methods=['POST'])
-def extract_batch():
-    if 'files[]' not in request.files:
-        return jsonify({'error': 'No files uploaded'}), 400
+BATCH_STREAM_MIMETYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'sse': 'text/event-stream',
+}
+
+# Upload checks shared with the async extraction endpoints in asgi.py
+def check_extract_single_upload(files):
+    """Returns an error message for an invalid /extract-single upload, or None"""
+    if 'file' not in files:
+        return 'No file uploaded'
     
-    files = request.files.getlist('files[]')
+    file = files['file']
+    if file.filename == '':
+        return 'No file selected'
+    
+    if not file.filename.lower().endswith('.pdf'):
+        return 'File must be a PDF'
+    
+    # Check file size (45MB)
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    file.seek(0)
+    
+    if file_size > 45 * 1024 * 1024:  # 45MB in bytes
+        return 'File size exceeds 45MB limit'
+    return None
+
+def check_extract_batch_upload(files):
+    """Returns an error message for an invalid /extract-batch upload, or None"""
+    if 'files[]' not in files:
+        return 'No files uploaded'
+    
+    files = files.getlist('files[]')
     if not files or files[0].filename == '':
-        return jsonify({'error': 'No files selected'}), 400
+        return 'No files selected'
     
     # Check if all files are PDFs
     for file in files:
         if not file.filename.lower().endswith('.pdf'):
-            return jsonify({'error': 'All files must be PDFs'}), 400
+            return 'All files must be PDFs'
     
     # Check total size limit (100MB)
     total_size = 0
@@ -384,28 +723,121 @@ def extract_batch():
         file.seek(0)
     
     if total_size > 100 * 1024 * 1024:  # 100MB in bytes
-        return jsonify({'error': 'Total size exceeds 100MB limit'}), 400
+        return 'Total size exceeds 100MB limit'
     
     if len(files) > 100:
-        return jsonify({'error': 'Maximum 100 PDFs allowed'}), 400
+        return 'Maximum 100 PDFs allowed'
+    return None
+
+def get_fields_to_extract(form):
+    """Fields requested for extraction, or None to extract all detected fields"""
+    if 'fields' in form and form['fields'].strip():
+        return [field.strip() for field in form['fields'].split(',')]
+    return None
+
+def new_batch_dir():
+    temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"batch_{datetime.now().strftime('%Y%m%d%H%M%S')}_{os.urandom(4).hex()}")
+    os.makedirs(temp_dir, exist_ok=True)
+    return temp_dir
+
+def write_batch_csv(extracted_data):
+    """Writes a list of {'filename', 'data'} results to a CSV in the processed folder and returns its name"""
+    csv_filename = f"extracted_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+    csv_path = os.path.join(app.config['PROCESSED_FOLDER'], csv_filename)
+    
+    # Write CSV file
+    with open(csv_path, 'w', newline='') as csvfile:
+        # Determine all possible fields from all documents
+        all_fields = set()
+        for item in extracted_data:
+            all_fields.update(item['data'].keys())
+        
+        fieldnames = ['filename'] + sorted(list(all_fields))
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        
+        for item in extracted_data:
+            row = {'filename': item['filename']}
+            row.update(item['data'])
+            writer.writerow(row)
+    return csv_filename
+
+def remove_batch_files(temp_dir, file_paths):
+    for path in file_paths:
+        try:
+            os.remove(path)
+        except:
+            pass
+    try:
+        os.rmdir(temp_dir)
+    except:
+        pass
+
+def stream_batch_results(temp_dir, file_paths, fields_to_extract, output_format):
+    """Extract one file at a time and send each result as soon as it is ready"""
+    def generate():
+        csv_writer = StreamingCsvWriter(fields_to_extract)
+        try:
+            for index, path in enumerate(file_paths):
+                filename = os.path.basename(path)
+                data, error = extract_data_with_error(path, fields_to_extract)
+                try:
+                    os.remove(path)
+                except:
+                    pass
+
+                if output_format == 'jsonl':
+                    yield jsonl_record(filename, data, error)
+                elif output_format == 'csv':
+                    yield csv_writer.write(filename, data, error)
+                else:
+                    yield sse_event('result', batch_event(index, filename, data, error))
+
+            if output_format == 'csv':
+                yield csv_writer.finish()
+            elif output_format == 'sse':
+                yield sse_event('done', {'count': len(file_paths)})
+        finally:
+            # Also runs when the client disconnects mid-batch
+            remove_batch_files(temp_dir, file_paths)
+
+    response = Response(stream_with_context(generate()), mimetype=BATCH_STREAM_MIMETYPES[output_format])
+    response.headers['Cache-Control'] = 'no-cache'
+    # Ask proxies such as nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    if output_format == 'csv':
+        csv_filename = f"extracted_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        response.headers['Content-Disposition'] = f'attachment; filename="{csv_filename}"'
+    return response
+
+@app.route('/extract-batch', methods=['POST'])
+def extract_batch():
+    error = check_extract_batch_upload(request.files)
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Get fields to extract (if specified)
-    fields_to_extract = None
-    if 'fields' in request.form and request.form['fields'].strip():
-        fields_to_extract = [field.strip() for field in request.form['fields'].split(',')]
+    files = request.files.getlist('files[]')
+    fields_to_extract = get_fields_to_extract(request.form)
+    
+    # Optional streamed output: jsonl, csv or sse
+    output_format = request.form.get('format', '')
     
     try:
         # Create a temporary directory for processing
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"batch_{datetime.now().strftime('%Y%m%d%H%M%S')}")
-        os.makedirs(temp_dir, exist_ok=True)
+        temp_dir = new_batch_dir()
         
         # Save files temporarily
         file_paths = []
         for file in files:
             temp_path = os.path.join(temp_dir, file.filename)
-            file.save(temp_path)
+            with metrics.stage("upload_save", "extract"):
+                file.save(temp_path)
             file_paths.append(temp_path)
         
+        # Stream results as they finish instead of collecting the whole batch
+        if output_format in BATCH_STREAM_MIMETYPES:
+            return stream_batch_results(temp_dir, file_paths, fields_to_extract, output_format)
+        
         # Process PDFs and extract data
         extracted_data = []
         for path in file_paths:
@@ -417,35 +849,10 @@ def extract_batch():
             })
         
         # Create CSV from extracted data
-        csv_filename = f"extracted_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
-        csv_path = os.path.join(app.config['PROCESSED_FOLDER'], csv_filename)
-        
-        # Write CSV file
-        with open(csv_path, 'w', newline='') as csvfile:
-            # Determine all possible fields from all documents
-            all_fields = set()
-            for item in extracted_data:
-                all_fields.update(item['data'].keys())
-            
-            fieldnames = ['filename'] + sorted(list(all_fields))
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for item in extracted_data:
-                row = {'filename': item['filename']}
-                row.update(item['data'])
-                writer.writerow(row)
+        csv_filename = write_batch_csv(extracted_data)
         
         # Clean up temporary files
-        for path in file_paths:
-            try:
-                os.remove(path)
-            except:
-                pass
-        try:
-            os.rmdir(temp_dir)
-        except:
-            pass
+        remove_batch_files(temp_dir, file_paths)
         
         return jsonify({'success': True, 'csv_filename': csv_filename})
     except Exception as e:
@@ -453,28 +860,17 @@ def extract_batch():
 
 @app.route('/extract-single', methods=['POST'])
 def extract_single():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
+    error = check_extract_single_upload(request.files)
+    if error:
+        return jsonify({'error': error}), 400
     
     file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    if not file.filename.lower().endswith('.pdf'):
-        return jsonify({'error': 'File must be a PDF'}), 400
-    
-    # Check file size (45MB)
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    
-    if file_size > 45 * 1024 * 1024:  # 45MB in bytes
-        return jsonify({'error': 'File size exceeds 45MB limit'}), 400
     
     try:
         # Save file temporarily
         temp_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(temp_path)
+        with metrics.stage("upload_save", "extract"):
+            file.save(temp_path)
         
         # Extract data from PDF
         data = extract_data_from_pdf(temp_path)
@@ -610,6 +1006,64 @@ def generate_static_sitemap():
     
     print(f"Static sitemap.xml generated with {len(pages)} URLs")
 
+@app.errorhandler(AdmissionRejected)
+def handle_admission_rejected(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose counters and timings in Prometheus text format (see metrics.METRICS_DIR)"""
+    response = make_response(metrics.render_prometheus())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.begin_request()
+    metrics.add_gauge('http_requests_in_flight', 1)
+    profiling.begin_request(request.headers.get(profiling.PROFILE_HEADER))
+
+def record_request(endpoint, method, status, elapsed, bytes_in, bytes_out):
+    """Records request metrics and writes the structured request log line"""
+    metrics.increment('http_requests_total', endpoint=endpoint, method=method, status=status)
+    metrics.observe('http_request_seconds', elapsed, endpoint=endpoint)
+    metrics.increment('http_request_bytes_total', bytes_in, endpoint=endpoint)
+    metrics.increment('http_response_bytes_total', bytes_out, endpoint=endpoint)
+
+    details = metrics.request_details()
+    stages = metrics.end_request()
+    if endpoint not in ('static', 'metrics_endpoint'):
+        app.logger.info(json.dumps({
+            'event': 'request',
+            'endpoint': endpoint,
+            'method': method,
+            'status': status,
+            'duration_ms': round(elapsed * 1000, 2),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'stages_ms': {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+            **details,
+        }))
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    record_request(request.endpoint or 'unknown', request.method, response.status_code,
+                   elapsed, request.content_length or 0, response.content_length or 0)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'request_start' in g:
+        metrics.add_gauge('http_requests_in_flight', -1)
+    profiling.end_request()
+
 @app.route('/robots.txt')
 def robots():
     return send_from_directory(app.static_folder, 'robots.txt')
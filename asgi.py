@@ -0,0 +1,254 @@
+"""
+ASGI entry point with native async extraction endpoints.
+
+/extract-single and /extract-batch spend nearly all their time waiting on the
+Mistral API. Here they run on the event loop with the SDK's async client, so one
+worker process keeps many extractions in flight. Every other route is passed to
+the Flask app unchanged.
+
+Run the extraction endpoints on async workers and keep the CPU-heavy PDF tools on
+sync workers, routing /extract-* to the async service in the reverse proxy:
+
+    gunicorn app:app --workers 4
+    gunicorn asgi:app --workers 2 -k uvicorn.workers.UvicornWorker --bind :8001
+
+A single `gunicorn asgi:app -k uvicorn.workers.UvicornWorker` also serves the
+whole site, with Flask routes running in a thread pool.
+"""
+import os
+import json
+import time
+import asyncio
+import tempfile
+from datetime import datetime
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.wrappers import Request
+
+from app import (
+    app as flask_app, BATCH_STREAM_MIMETYPES, check_extract_single_upload, check_extract_batch_upload,
+    get_fields_to_extract, new_batch_dir, write_batch_csv, remove_batch_files, record_request,
+)
+from src import metrics, profiling
+from src.batch_output import StreamingCsvWriter, jsonl_record, sse_event, batch_event
+from src.extract_data import extract_data_from_pdf_async, extract_batch_async, start_async_extraction
+
+# Request bodies larger than this are buffered on disk instead of in memory
+BODY_SPOOL_BYTES = 1024 * 1024
+
+SECURITY_HEADERS = [
+    (b'x-content-type-options', b'nosniff'),
+    (b'x-frame-options', b'SAMEORIGIN'),
+    (b'x-xss-protection', b'1; mode=block'),
+]
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+async def read_request(scope, receive):
+    """
+    Buffers the request body and wraps it in a Werkzeug request, so form and file
+    handling work the same as in the Flask routes.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('Client disconnected')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > flask_app.config['MAX_CONTENT_LENGTH']:
+            body.close()
+            raise RequestTooLarge()
+        body.write(chunk)
+        more_body = message.get('more_body', False)
+    body.seek(0)
+
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'CONTENT_TYPE': headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(size),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': body,
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+    }
+    request = Request(environ)
+    # Multipart parsing is CPU work; keep it off the event loop
+    await asyncio.to_thread(lambda: (request.form, request.files))
+    return request
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + SECURITY_HEADERS,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+    return len(body)
+
+
+async def extract_single(request, send):
+    error = check_extract_single_upload(request.files)
+    if error:
+        return 400, await send_json(send, 400, {'error': error})
+
+    file = request.files['file']
+    temp_path = os.path.join(flask_app.config['UPLOAD_FOLDER'], f"{os.urandom(4).hex()}_{os.path.basename(file.filename)}")
+    try:
+        with metrics.stage("upload_save", "extract"):
+            await asyncio.to_thread(file.save, temp_path)
+        data = await extract_data_from_pdf_async(temp_path)
+    except Exception as e:
+        return 500, await send_json(send, 500, {'error': str(e)})
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    return 200, await send_json(send, 200, {'success': True, 'data': data})
+
+
+async def extract_batch(request, send):
+    error = check_extract_batch_upload(request.files)
+    if error:
+        return 400, await send_json(send, 400, {'error': error})
+
+    files = request.files.getlist('files[]')
+    fields_to_extract = get_fields_to_extract(request.form)
+    output_format = request.form.get('format', '')
+
+    temp_dir = new_batch_dir()
+    file_paths = []
+    try:
+        with metrics.stage("upload_save", "extract"):
+            for file in files:
+                temp_path = os.path.join(temp_dir, os.path.basename(file.filename))
+                await asyncio.to_thread(file.save, temp_path)
+                file_paths.append(temp_path)
+    except Exception as e:
+        remove_batch_files(temp_dir, file_paths)
+        return 500, await send_json(send, 500, {'error': str(e)})
+
+    if output_format in BATCH_STREAM_MIMETYPES:
+        # Once streaming has started, errors can only end the response early
+        try:
+            return 200, await stream_batch_results(send, file_paths, fields_to_extract, output_format)
+        finally:
+            remove_batch_files(temp_dir, file_paths)
+
+    try:
+        extracted_data = [None] * len(file_paths)
+        async for index, path, data, _ in extract_batch_async(file_paths, fields_to_extract):
+            extracted_data[index] = {'filename': os.path.basename(path), 'data': data}
+        csv_filename = await asyncio.to_thread(write_batch_csv, extracted_data)
+        return 200, await send_json(send, 200, {'success': True, 'csv_filename': csv_filename})
+    except Exception as e:
+        return 500, await send_json(send, 500, {'error': str(e)})
+    finally:
+        remove_batch_files(temp_dir, file_paths)
+
+
+async def stream_batch_results(send, file_paths, fields_to_extract, output_format):
+    """
+    Sends each result as soon as its extraction finishes. Documents are extracted
+    concurrently, so results arrive in completion order; SSE events carry the index.
+    :return: Number of body bytes sent.
+    """
+    headers = [
+        (b'content-type', BATCH_STREAM_MIMETYPES[output_format].encode()),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ] + SECURITY_HEADERS
+    if output_format == 'csv':
+        csv_filename = f"extracted_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        headers.append((b'content-disposition', f'attachment; filename="{csv_filename}"'.encode()))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+    csv_writer = StreamingCsvWriter(fields_to_extract)
+    sent = 0
+    async for index, path, data, error in extract_batch_async(file_paths, fields_to_extract):
+        filename = os.path.basename(path)
+        if output_format == 'jsonl':
+            chunk = jsonl_record(filename, data, error)
+        elif output_format == 'csv':
+            chunk = csv_writer.write(filename, data, error)
+        else:
+            chunk = sse_event('result', batch_event(index, filename, data, error))
+        chunk = chunk.encode()
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        sent += len(chunk)
+
+    if output_format == 'csv':
+        tail = csv_writer.finish().encode()
+    elif output_format == 'sse':
+        tail = sse_event('done', {'count': len(file_paths)}).encode()
+    else:
+        tail = b''
+    await send({'type': 'http.response.body', 'body': tail})
+    return sent + len(tail)
+
+
+ASYNC_ROUTES = {
+    '/extract-single': ('extract_single', extract_single),
+    '/extract-batch': ('extract_batch', extract_batch),
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_async_extraction()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+    if route is None:
+        return await flask_asgi(scope, receive, send)
+
+    endpoint, handler = route
+    start = time.perf_counter()
+    metrics.begin_request()
+    metrics.add_gauge('http_requests_in_flight', 1)
+    profile_header = dict(scope['headers']).get(profiling.PROFILE_HEADER.lower().encode())
+    profiling.begin_request(profile_header.decode('latin-1') if profile_header else None)
+    status, bytes_in, bytes_out = 500, 0, 0
+    try:
+        try:
+            request = await read_request(scope, receive)
+        except RequestTooLarge:
+            status = 413
+            bytes_out = await send_json(send, 413, {'error': 'Request entity too large'})
+            return
+        except ConnectionError:
+            # Client went away while uploading; nothing to respond to
+            status = 499
+            return
+        bytes_in = request.content_length or 0
+        status, bytes_out = await handler(request, send)
+    finally:
+        metrics.add_gauge('http_requests_in_flight', -1)
+        profiling.end_request()
+        record_request(endpoint, scope['method'], status, time.perf_counter() - start, bytes_in, bytes_out)
@@ -0,0 +1,220 @@
+"""
+Local stand-in for the parts of the Mistral API used by src/extract_data.py.
+
+Implements file upload, signed URLs, OCR and chat completions with configurable
+latency and error rate, so extraction can be load-tested without network access.
+OCR returns the text layer of the uploaded PDF as markdown; chat returns a JSON
+object with the requested fields.
+
+Usage:
+    python loadtest/fake_mistral.py --port 8765 --latency-ms 300 --error-rate 0.01
+    MISTRAL_SERVER_URL=http://127.0.0.1:8765 MISTRAL_API_KEY=fake gunicorn app:app
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pymupdf
+
+# Uploaded files by id; the fake keeps them in memory
+_files = {}
+_files_lock = threading.Lock()
+
+
+def parse_multipart(content_type, body):
+    """
+    Returns {field name: (filename, bytes)} for a multipart/form-data body.
+    """
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+
+def ocr_pages(content):
+    """
+    Builds OCR page objects from the PDF's own text layer.
+    """
+    try:
+        doc = pymupdf.open(stream=content, filetype="pdf")
+    except Exception:
+        return [{"index": 0, "markdown": "", "images": [], "dimensions": None}]
+    pages = []
+    with doc:
+        for page in doc:
+            pages.append({
+                "index": page.number,
+                "markdown": page.get_text() or f"Page {page.number + 1}",
+                "images": [],
+                "dimensions": {"dpi": 200, "width": int(page.rect.width), "height": int(page.rect.height)},
+            })
+    return pages
+
+
+def fake_extraction(prompt):
+    """
+    Produces a JSON object for the chat response. Requested fields get a value
+    only if the markdown mentions them, like a model reading one chunk of a
+    document; without requested fields a couple of generic ones are returned.
+    """
+    markdown = prompt.split("Convert this into a sensible structured json response.")[0]
+    match = re.search(r"Extract the following fields: (.+?)\. If given fields", prompt, re.S)
+    if not match:
+        return {"title": "value of title", "summary": "value of summary"}
+    fields = [f.strip() for f in match.group(1).split(",") if f.strip()]
+    return {
+        field: f"value of {field}" if field.lower() in markdown.lower() else ""
+        for field in fields
+    }
+
+
+class FakeMistralHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    ocr_ms_per_page = 0.0
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def _simulate(self, extra_ms=0.0):
+        """
+        Sleeps for the configured latency; returns False if this request should fail.
+        """
+        delay = self.latency_ms + extra_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(delay, 0) / 1000)
+        if random.random() < self.error_rate:
+            status = random.choice([429, 500, 503])
+            self._send_json(status, {"object": "error", "message": "Injected failure", "code": status})
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+            return
+        match = re.match(r"^/v1/files/([0-9a-f]+)/url", self.path)
+        if match:
+            if not self._simulate():
+                return
+            host = self.headers.get("Host", "127.0.0.1")
+            self._send_json(200, {"url": f"http://{host}/content/{match.group(1)}"})
+            return
+        self._send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        body = self._read_body()
+
+        if self.path.startswith("/v1/files"):
+            if not self._simulate():
+                return
+            fields = parse_multipart(self.headers["Content-Type"], body)
+            filename, content = fields.get("file", ("upload", b""))
+            file_id = uuid.uuid4().hex
+            with _files_lock:
+                _files[file_id] = content
+            self._send_json(200, {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename or "upload",
+                "purpose": "ocr",
+                "sample_type": "ocr_input",
+                "source": "upload",
+            })
+            return
+
+        if self.path.startswith("/v1/ocr"):
+            request = json.loads(body or b"{}")
+            url = request.get("document", {}).get("document_url", "")
+            file_id = url.rstrip("/").rsplit("/", 1)[-1]
+            with _files_lock:
+                content = _files.pop(file_id, b"")
+            pages = ocr_pages(content)
+            if not self._simulate(self.ocr_ms_per_page * len(pages)):
+                return
+            self._send_json(200, {
+                "pages": pages,
+                "model": request.get("model", "mistral-ocr-latest"),
+                "usage_info": {"pages_processed": len(pages), "doc_size_bytes": len(content)},
+            })
+            return
+
+        if self.path.startswith("/v1/chat/completions"):
+            if not self._simulate():
+                return
+            request = json.loads(body or b"{}")
+            prompt = ""
+            for message in request.get("messages", []):
+                content = message.get("content")
+                if isinstance(content, str):
+                    prompt += content
+                else:
+                    prompt += "".join(chunk.get("text", "") for chunk in content or [])
+            self._send_json(200, {
+                "id": uuid.uuid4().hex,
+                "object": "chat.completion",
+                "model": request.get("model", "ministral-8b-latest"),
+                "created": int(time.time()),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": json.dumps(fake_extraction(prompt))},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 20, "total_tokens": len(prompt) // 4 + 20},
+            })
+            return
+
+        self._send_json(404, {"message": "Not found"})
+
+
+def make_server(host="127.0.0.1", port=8765, latency_ms=0.0, jitter_ms=0.0, ocr_ms_per_page=0.0, error_rate=0.0):
+    handler = type("ConfiguredFakeMistralHandler", (FakeMistralHandler,), {
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "ocr_ms_per_page": ocr_ms_per_page,
+        "error_rate": error_rate,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Mistral API server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Base latency of every call")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Uniform +/- jitter on the latency")
+    parser.add_argument("--ocr-ms-per-page", type=float, default=100, help="Extra OCR latency per page")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency_ms, args.jitter_ms, args.ocr_ms_per_page, args.error_rate)
+    print(f"Fake Mistral API listening on http://{args.host}:{args.port}")
+    server.serve_forever()
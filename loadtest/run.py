@@ -0,0 +1,363 @@
+"""
+Load test for the Flask app running under gunicorn, with a local fake Mistral API.
+
+Starts loadtest/fake_mistral.py and gunicorn, generates test PDFs, then drives a
+weighted mix of endpoints with a fixed number of concurrent users for a fixed
+duration. Reports throughput, latency percentiles and error rate per endpoint,
+and the RSS of the gunicorn process tree over time. Needs no network access.
+
+Usage:
+    python loadtest/run.py --users 20 --duration 60 --workers 4 \\
+        --mix upload=4,remove=2,extract-single=2,extract-batch=1 --pages 1,10,50
+    python loadtest/run.py --target http://127.0.0.1:8000 ...   # use a running server
+    python loadtest/run.py --asgi-workers 1 ...   # serve /extract-* from asgi.py on uvicorn
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import pymupdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_test_pdfs(directory, page_counts):
+    """
+    Writes one dark, text-bearing test PDF per requested page count.
+    :return: Dictionary mapping page count to path.
+    """
+    paths = {}
+    for pages in page_counts:
+        doc = pymupdf.open()
+        for number in range(pages):
+            page = doc.new_page()
+            page.draw_rect(page.rect, color=(0.1, 0.1, 0.1), fill=(0.1, 0.1, 0.1))
+            page.insert_text((72, 72), f"Invoice {number + 1}", fontsize=24, color=(1, 1, 1))
+            page.insert_text((72, 120), "Total: 123.45 EUR", fontsize=14, color=(1, 1, 1))
+        path = os.path.join(directory, f"test_{pages}p.pdf")
+        doc.save(path)
+        doc.close()
+        paths[pages] = path
+    return paths
+
+
+def encode_multipart(fields, files):
+    """
+    Encodes form fields and (field, filename, bytes) files as multipart/form-data.
+    """
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+    for name, filename, content in files:
+        body += (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+            "Content-Type: application/pdf\r\n\r\n"
+        ).encode()
+        body += content + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+def build_request(endpoint, base_url, pdf_bytes, extract_url=None):
+    """
+    Builds (url, body, content type) for one call to an endpoint of the mix.
+    """
+    unique = f"lt_{uuid.uuid4().hex[:12]}.pdf"
+    if endpoint.startswith("extract") and extract_url:
+        base_url = extract_url
+    if endpoint == "upload":
+        body, ctype = encode_multipart({"mode": "all"}, [("file", unique, pdf_bytes)])
+        return f"{base_url}/upload", body, ctype
+    if endpoint == "upload-auto":
+        body, ctype = encode_multipart({"mode": "auto"}, [("file", unique, pdf_bytes)])
+        return f"{base_url}/upload", body, ctype
+    if endpoint == "remove":
+        body, ctype = encode_multipart({"pages": "1"}, [("file", unique, pdf_bytes)])
+        return f"{base_url}/remove", body, ctype
+    if endpoint == "customize":
+        body, ctype = encode_multipart({"bg_color": "#000000", "text_color": "#ffffff"}, [("file", unique, pdf_bytes)])
+        return f"{base_url}/customize-pdf", body, ctype
+    if endpoint == "merge":
+        files = [("files[]", f"{i}_{unique}", pdf_bytes) for i in range(2)]
+        body, ctype = encode_multipart({}, files)
+        return f"{base_url}/merge-pdfs", body, ctype
+    if endpoint == "extract-single":
+        body, ctype = encode_multipart({}, [("file", unique, pdf_bytes)])
+        return f"{base_url}/extract-single", body, ctype
+    if endpoint == "extract-batch":
+        files = [("files[]", f"{i}_{unique}", pdf_bytes) for i in range(3)]
+        body, ctype = encode_multipart({"fields": "invoice number,total"}, files)
+        return f"{base_url}/extract-batch", body, ctype
+    raise ValueError(f"Unknown endpoint in mix: {endpoint}")
+
+
+ENDPOINTS = ("upload", "upload-auto", "remove", "customize", "merge", "extract-single", "extract-batch")
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}', choose from: {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def process_tree_rss(pids):
+    """
+    Sums VmRSS (bytes) of processes and all their descendants using /proc.
+    """
+    total = 0
+    pending = list(pids)
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2)
+            return
+        except urllib.error.HTTPError:
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def run_load(base_url, weights, pdfs, users, duration, timeout, extract_url=None):
+    """
+    Runs closed-loop virtual users until the duration has passed.
+    :return: List of (endpoint, start offset, latency seconds, status or error string).
+    """
+    results = []
+    results_lock = threading.Lock()
+    names = list(weights)
+    cumulative = [weights[name] for name in names]
+    pdf_bytes = {pages: open(path, "rb").read() for pages, path in pdfs.items()}
+    started = time.perf_counter()
+    stop_at = started + duration
+
+    def user():
+        while time.perf_counter() < stop_at:
+            endpoint = random.choices(names, weights=cumulative)[0]
+            choices = list(pdf_bytes)
+            if endpoint == "remove":
+                # Removing the only page of a document is rejected, so use multi-page files
+                choices = [pages for pages in choices if pages > 1] or choices
+            pages = random.choice(choices)
+            url, body, ctype = build_request(endpoint, base_url, pdf_bytes[pages], extract_url)
+            request = urllib.request.Request(url, data=body, headers={"Content-Type": ctype}, method="POST")
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - t0
+            with results_lock:
+                results.append((f"{endpoint}[{pages}p]", t0 - started, elapsed, status))
+
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, rss_samples):
+    by_endpoint = defaultdict(list)
+    for endpoint, _, latency, status in results:
+        by_endpoint[endpoint].append((latency, status))
+
+    summary = {"duration_seconds": round(elapsed, 2), "endpoints": {}, "rss": rss_samples}
+    print(f"\n{'endpoint':<26}{'count':>7}{'rps':>8}{'err%':>7}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint in sorted(by_endpoint):
+        entries = by_endpoint[endpoint]
+        latencies = [latency * 1000 for latency, _ in entries]
+        errors = sum(1 for _, status in entries if not (isinstance(status, int) and status < 400))
+        row = {
+            "count": len(entries),
+            "rps": len(entries) / elapsed,
+            "error_rate": errors / len(entries),
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies),
+        }
+        summary["endpoints"][endpoint] = row
+        print(f"{endpoint:<26}{row['count']:>7}{row['rps']:>8.2f}{row['error_rate'] * 100:>7.1f}"
+              f"{row['p50_ms']:>9.0f}{row['p90_ms']:>9.0f}{row['p99_ms']:>9.0f}{row['max_ms']:>9.0f}")
+
+    total = len(results)
+    errors = sum(1 for *_, status in results if not (isinstance(status, int) and status < 400))
+    statuses = defaultdict(int)
+    for *_, status in results:
+        statuses[str(status)] += 1
+    summary["total"] = {"count": total, "rps": total / elapsed if elapsed else 0, "error_rate": errors / total if total else 0}
+    summary["statuses"] = dict(statuses)
+    print(f"\nTotal: {total} requests, {summary['total']['rps']:.2f} req/s, "
+          f"{summary['total']['error_rate'] * 100:.1f}% errors, statuses {dict(statuses)}")
+
+    if rss_samples:
+        peak = max(rss for _, rss in rss_samples)
+        print(f"Server RSS: start {rss_samples[0][1] / 2**20:.0f} MB, peak {peak / 2**20:.0f} MB, "
+              f"end {rss_samples[-1][1] / 2**20:.0f} MB")
+        step = max(1, len(rss_samples) // 20)
+        print("RSS over time (s: MB): " + ", ".join(
+            f"{t:.0f}: {rss / 2**20:.0f}" for t, rss in rss_samples[::step]))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the PDF tools under gunicorn")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Test duration in seconds")
+    parser.add_argument("--mix", default="upload=3,remove=2,customize=1,merge=1,extract-single=2,extract-batch=1",
+                        help="Weighted endpoint mix, e.g. upload=3,extract-single=1")
+    parser.add_argument("--pages", default="1,10", help="Comma-separated page counts of the generated PDFs")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--target", help="Base URL of an already running server (skips gunicorn)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--worker-class", default="gthread", help="gunicorn worker class")
+    parser.add_argument("--port", type=int, default=8099, help="Port for gunicorn")
+    parser.add_argument("--asgi-workers", type=int, default=0,
+                        help="Serve /extract-* from asgi.py with this many uvicorn workers (0: use the sync app)")
+    parser.add_argument("--asgi-port", type=int, default=8098, help="Port for the async extraction service")
+    parser.add_argument("--mistral-port", type=int, default=8765, help="Port for the fake Mistral API")
+    parser.add_argument("--mistral-latency-ms", type=float, default=300)
+    parser.add_argument("--mistral-jitter-ms", type=float, default=100)
+    parser.add_argument("--mistral-ocr-ms-per-page", type=float, default=150)
+    parser.add_argument("--mistral-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    page_counts = [int(p) for p in args.pages.split(",")]
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+
+    try:
+        server_pids = []
+        extract_url = None
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            processes.append(subprocess.Popen([
+                sys.executable, os.path.join(REPO_ROOT, "loadtest", "fake_mistral.py"),
+                "--port", str(args.mistral_port),
+                "--latency-ms", str(args.mistral_latency_ms),
+                "--jitter-ms", str(args.mistral_jitter_ms),
+                "--ocr-ms-per-page", str(args.mistral_ocr_ms_per_page),
+                "--error-rate", str(args.mistral_error_rate),
+            ]))
+            env = dict(os.environ,
+                       MISTRAL_API_KEY="fake",
+                       MISTRAL_SERVER_URL=f"http://127.0.0.1:{args.mistral_port}")
+            gunicorn = subprocess.Popen([
+                sys.executable, "-m", "gunicorn", "app:app",
+                "--bind", f"127.0.0.1:{args.port}",
+                "--workers", str(args.workers),
+                "--threads", str(args.threads),
+                "--worker-class", args.worker_class,
+                "--timeout", str(int(args.timeout)),
+                "--log-level", "warning",
+            ], cwd=REPO_ROOT, env=env)
+            processes.append(gunicorn)
+            server_pids.append(gunicorn.pid)
+            base_url = f"http://127.0.0.1:{args.port}"
+            if args.asgi_workers:
+                asgi = subprocess.Popen([
+                    sys.executable, "-m", "gunicorn", "asgi:app",
+                    "--bind", f"127.0.0.1:{args.asgi_port}",
+                    "--workers", str(args.asgi_workers),
+                    "--worker-class", "uvicorn.workers.UvicornWorker",
+                    "--timeout", str(int(args.timeout)),
+                    "--log-level", "warning",
+                ], cwd=REPO_ROOT, env=env)
+                processes.append(asgi)
+                server_pids.append(asgi.pid)
+                extract_url = f"http://127.0.0.1:{args.asgi_port}"
+                wait_for(f"{extract_url}/robots.txt")
+            wait_for(f"http://127.0.0.1:{args.mistral_port}/health")
+            wait_for(f"{base_url}/robots.txt")
+
+        pdfs = make_test_pdfs(workdir, page_counts)
+        print(f"Driving {base_url} with {args.users} users for {args.duration:.0f}s, mix {weights}, pages {page_counts}")
+
+        rss_samples = []
+        stop_sampling = threading.Event()
+
+        def sample_rss():
+            start = time.perf_counter()
+            while not stop_sampling.is_set():
+                rss_samples.append((time.perf_counter() - start, process_tree_rss(server_pids)))
+                stop_sampling.wait(1)
+
+        sampler = None
+        if server_pids:
+            sampler = threading.Thread(target=sample_rss, daemon=True)
+            sampler.start()
+
+        results, elapsed = run_load(base_url, weights, pdfs, args.users, args.duration, args.timeout, extract_url)
+        stop_sampling.set()
+        if sampler:
+            sampler.join()
+
+        summary = summarize(results, elapsed, rss_samples)
+        if args.json:
+            summary["config"] = vars(args)
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+            print(f"Report written to {args.json}")
+    finally:
+        for process in reversed(processes):
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,40 @@
-import pdfkit
-from jinja2 import Environment, FileSystemLoader
+"""
+Builds one market research worksheet PDF per business from market_research.html.
 
-# Set up Jinja2 environment
-env = Environment(loader=FileSystemLoader('.'))
-template = env.get_template('./notebooks/market_research.html')
+Reports are laid out with PyMuPDF in parallel worker processes, and only reports
+whose inputs changed are rebuilt. Run from the repository root:
+
+    python notebooks/market_research.py [--workers N] [--force] [--backend pdfkit]
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.report_generator import ReportJob, build_reports, print_summary, REPORT_BACKENDS
+
+TEMPLATE = './notebooks/market_research.html'
+OUTPUT_DIR = './pdfs'
+
+# MuPDF ignores min-height, so the answer boxes get their writing space from padding
+STORY_CSS = """
+.answer-box { padding-bottom: 107px; }
+.small-answer-box { padding-bottom: 42px; }
+.question-box { padding-bottom: 18px; }
+"""
 
-# Render HTML with your dynamic title
 businesses = ["Library", "Vending Machine", "Airbnb", "Saffron Farming", "Mineral Water Plant", "RO Water Plant", "Microgreen Farming", "Bitcoin Mining", "Coaching Institute", "Tshirtwear(B2B)", "Solar Farm", "Gym Diet Food", "Organic Supermarket", "Car - washing", "ATM business", "Cold Storage", "Pure Juice Factory", "White board markers", "Cottage Industry - Create packaging material, boxes", "Notebook making", "Aluminium Foil Manufacturing", "Tissue Paper Manufacturing", "Paver Block Manufacturing", "Non woven bag(Cotton bag)", "Coffee Cup Manufacturing", "Paper Plate Manufacturing", "Papad Making"]
-for b in businesses:
-    html_content = template.render(title=b)
 
-    # Convert HTML to PDF
-    pdfkit.from_string(html_content, f'./pdfs/{b}.pdf')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build market research worksheet PDFs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--backend", choices=REPORT_BACKENDS, default="story")
+    parser.add_argument("--force", action="store_true", help="Rebuild all reports")
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    jobs = [ReportJob(f"{b}.pdf", {"title": b}) for b in businesses]
+    summary = build_reports(TEMPLATE, jobs, args.output, workers=args.workers, backend=args.backend,
+                            margins_mm=(20, 22, 20, 22), story_css=STORY_CSS, force=args.force)
+    print_summary(summary)
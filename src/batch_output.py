@@ -0,0 +1,104 @@
+import io
+import csv
+import json
+
+# Column holding fields that appear after the CSV header was sent
+EXTRA_COLUMN = "_extra"
+# Column holding the error of documents that could not be extracted
+ERROR_COLUMN = "_error"
+
+
+def _cell(value):
+    # Nested values are kept machine-readable instead of Python reprs
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def jsonl_record(filename, data, error=None):
+    """
+    Formats one extraction result as a JSON Lines record.
+    """
+    record = {"filename": filename, "data": data}
+    if error:
+        record["error"] = error
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def batch_event(index, filename, data, error=None):
+    """
+    Payload of the server-sent event for one document of a batch.
+    """
+    payload = {"index": index, "filename": filename, "data": data}
+    if error:
+        payload["error"] = error
+    return payload
+
+
+def sse_event(event, payload):
+    """
+    Formats a server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class StreamingCsvWriter:
+    """
+    Turns extraction results into CSV text one row at a time.
+
+    The header cannot wait for every document, so it is fixed by the first
+    document with data: the requested fields if any, otherwise that document's
+    fields. Failed or empty documents that come first are held back until then.
+    Fields that only show up in later documents are written as a JSON object in
+    the "_extra" column, and extraction errors in the "_error" column.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = list(fields) if fields else None
+        self._header_sent = False
+        self._pending = []
+
+    def _format(self, row):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        return buffer.getvalue()
+
+    def _row(self, filename, data, error):
+        extra = {key: value for key, value in data.items() if key not in self.fields}
+        row = [filename] + [_cell(data.get(field, "")) for field in self.fields]
+        row.append(json.dumps(extra, ensure_ascii=False) if extra else "")
+        row.append(error or "")
+        return self._format(row)
+
+    def _header(self):
+        self._header_sent = True
+        output = self._format(["filename"] + self.fields + [EXTRA_COLUMN, ERROR_COLUMN])
+        for filename, data, error in self._pending:
+            output += self._row(filename, data, error)
+        self._pending = []
+        return output
+
+    def write(self, filename, data, error=None):
+        """
+        Formats one document's data as CSV.
+        :param error: Why extraction failed, if it did.
+        :return: CSV text (including the header once it is known); empty while rows are held back.
+        """
+        data = data or {}
+        if self._header_sent:
+            return self._row(filename, data, error)
+        if self.fields is None and (error or not data):
+            self._pending.append((filename, data, error))
+            return ""
+        if self.fields is None:
+            self.fields = sorted(data.keys())
+        return self._header() + self._row(filename, data, error)
+
+    def finish(self):
+        """
+        :return: CSV text still held back, e.g. when no document had data.
+        """
+        if self._header_sent:
+            return ""
+        self.fields = self.fields or []
+        return self._header()
@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+# Default and maximum size of a single chunk
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+# Unfinished uploads older than this are deleted
+UPLOAD_EXPIRY_SECONDS = 24 * 60 * 60
+# Block size used when streaming a chunk from the request to disk
+STREAM_BLOCK_SIZE = 64 * 1024
+
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _upload_dir(root, upload_id):
+    if not _UPLOAD_ID_PATTERN.match(upload_id or ""):
+        raise ValueError("Invalid upload id")
+    return os.path.join(root, upload_id)
+
+
+def _chunk_count(meta):
+    return max(1, -(-meta["size"] // meta["chunk_size"]))
+
+
+def create_upload(root, filename, size, chunk_size=DEFAULT_CHUNK_SIZE, max_size=None):
+    """
+    Starts a chunked upload and preallocates the target file on disk.
+    :param root: Directory holding in-progress uploads.
+    :param filename: Original file name.
+    :param size: Total size of the file in bytes.
+    :param chunk_size: Size of every chunk except the last.
+    :param max_size: Largest accepted file size, if limited.
+    :return: Upload metadata dictionary.
+    :raises ValueError: If the parameters are invalid.
+    """
+    filename = os.path.basename(filename or "")
+    if not filename.lower().endswith(".pdf"):
+        raise ValueError("File must be a PDF")
+    if not isinstance(size, int) or size <= 0:
+        raise ValueError("Invalid file size")
+    if max_size is not None and size > max_size:
+        raise ValueError(f"File size exceeds {max_size // (1024 * 1024)}MB limit")
+    if not isinstance(chunk_size, int) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError("Invalid chunk size")
+
+    cleanup_stale_uploads(root)
+
+    upload_id = uuid.uuid4().hex
+    upload_dir = _upload_dir(root, upload_id)
+    os.makedirs(upload_dir)
+
+    meta = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": size,
+        "chunk_size": chunk_size,
+        "created": time.time(),
+    }
+    meta["chunk_count"] = _chunk_count(meta)
+    with open(os.path.join(upload_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    # Chunks are written in place, so the file never has to be assembled in memory
+    with open(os.path.join(upload_dir, "data"), "wb") as f:
+        f.truncate(size)
+    return meta
+
+
+def load_upload(root, upload_id):
+    """
+    Returns the metadata of an upload, or None if it does not exist.
+    """
+    path = os.path.join(_upload_dir(root, upload_id), "meta.json")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def received_chunks(root, upload_id):
+    """
+    Lists the indexes of the chunks that were received and verified.
+    """
+    upload_dir = _upload_dir(root, upload_id)
+    return sorted(
+        int(name[:-3]) for name in os.listdir(upload_dir)
+        if name.endswith(".ok") and name[:-3].isdigit()
+    )
+
+
+def write_chunk(root, upload_id, index, stream, sha256=None):
+    """
+    Streams one chunk to its offset in the target file and verifies its checksum.
+    Chunks can be re-sent; a retried chunk overwrites the previous attempt.
+    :param root: Directory holding in-progress uploads.
+    :param upload_id: Upload id returned by create_upload.
+    :param index: 0-based chunk index.
+    :param stream: File-like object with the chunk's bytes.
+    :param sha256: Expected hex SHA-256 of the chunk, if the client sent one.
+    :raises LookupError: If the upload does not exist.
+    :raises ValueError: If the chunk is out of range, has the wrong size or checksum.
+    """
+    meta = load_upload(root, upload_id)
+    if meta is None:
+        raise LookupError("Upload not found")
+    if not 0 <= index < meta["chunk_count"]:
+        raise ValueError("Chunk index out of range")
+
+    upload_dir = _upload_dir(root, upload_id)
+    offset = index * meta["chunk_size"]
+    expected_length = min(meta["chunk_size"], meta["size"] - offset)
+    marker = os.path.join(upload_dir, f"{index}.ok")
+    if os.path.exists(marker):
+        os.remove(marker)
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(os.path.join(upload_dir, "data"), "r+b") as f:
+        f.seek(offset)
+        while True:
+            block = stream.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            if written + len(block) > expected_length:
+                raise ValueError(f"Chunk {index} is larger than {expected_length} bytes")
+            digest.update(block)
+            f.write(block)
+            written += len(block)
+
+    if written != expected_length:
+        raise ValueError(f"Chunk {index} should be {expected_length} bytes, got {written}")
+    if sha256 and digest.hexdigest() != sha256.lower():
+        raise ValueError(f"Checksum mismatch for chunk {index}")
+
+    open(marker, "w").close()
+
+
+def finalize_upload(root, upload_id, dest_dir):
+    """
+    Moves a fully received upload into dest_dir and removes its session.
+    :return: Path of the assembled file.
+    :raises LookupError: If the upload does not exist.
+    :raises ValueError: If chunks are missing.
+    """
+    meta = load_upload(root, upload_id)
+    if meta is None:
+        raise LookupError("Upload not found")
+    missing = sorted(set(range(meta["chunk_count"])) - set(received_chunks(root, upload_id)))
+    if missing:
+        raise ValueError(f"Missing chunks: {missing[:20]}")
+
+    upload_dir = _upload_dir(root, upload_id)
+    dest_path = os.path.join(dest_dir, meta["filename"])
+    os.replace(os.path.join(upload_dir, "data"), dest_path)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return dest_path
+
+
+def cleanup_stale_uploads(root, max_age=UPLOAD_EXPIRY_SECONDS):
+    """
+    Deletes upload sessions that were started more than max_age seconds ago.
+    """
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
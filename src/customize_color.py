@@ -0,0 +1,116 @@
+import re
+import time
+import pymupdf
+
+from src import metrics
+from src.profiling import profiled
+from src.pdf_output import save_pdf
+
+HEX_COLOR_PATTERN = re.compile(r'^#(?:[0-9a-fA-F]{3}){1,2}$')
+
+
+def hex_to_rgb(hex_color):
+    """
+    Converts "#rrggbb" or "#rgb" to an (r, g, b) tuple of floats in [0, 1].
+    :raises ValueError: If the color is not a valid hex color.
+    """
+    if not isinstance(hex_color, str) or not HEX_COLOR_PATTERN.match(hex_color):
+        raise ValueError(f"Invalid color: {hex_color}")
+    digits = hex_color.lstrip('#')
+    if len(digits) == 3:
+        digits = ''.join(c * 2 for c in digits)
+    return tuple(int(digits[i:i+2], 16) / 255 for i in (0, 2, 4))
+
+
+@profiled("customize")
+def customize_pdf_colors(input_pdf_path, output_pdf_path, bg_rgb, text_rgb):
+    """
+    Redraws a PDF with a custom background and text color.
+    :param input_pdf_path: Path to the input PDF.
+    :param output_pdf_path: Path where the output PDF will be saved.
+    :param bg_rgb: Background color as an (r, g, b) tuple of floats in [0, 1].
+    :param text_rgb: Text color as an (r, g, b) tuple of floats in [0, 1].
+    """
+    # Open the PDF
+    with metrics.stage("open", "customize"):
+        doc = pymupdf.open(input_pdf_path)
+
+    recolor_document(doc, bg_rgb, text_rgb)
+
+    # Save the modified PDF
+    print("Saving the modified PDF")
+    with metrics.stage("save", "customize"):
+        save_pdf(doc, output_pdf_path)
+    doc.close()
+
+
+def recolor_document(doc, bg_rgb, text_rgb):
+    """
+    Paints a background over every page of an open document and redraws its text on top.
+    :param doc: A PyMuPDF Document, modified in place.
+    :param bg_rgb: Background color as an (r, g, b) tuple of floats in [0, 1].
+    :param text_rgb: Text color as an (r, g, b) tuple of floats in [0, 1].
+    """
+    # Process each page
+    recolor_start = time.perf_counter()
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+
+        # Create a rectangle covering the entire page
+        rect = page.rect
+
+        # Add a colored background
+        page.draw_rect(rect, color=bg_rgb, fill=bg_rgb)
+
+        # Get the text
+        text_blocks = page.get_text("dict")["blocks"]
+
+        # Define a list of fallback fonts that should be available in PyMuPDF
+        fallback_fonts = ["helvetica", "times-roman", "courier"]
+
+        # Draw text in the specified color
+        for block in text_blocks:
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        # Extract text and position
+                        text = span["text"]
+                        origin = pymupdf.Point(span["origin"])
+                        font_size = span["size"]
+
+                        # Try to use a fallback font instead of the original
+                        # This avoids the "need font file or buffer" error
+                        try:
+                            # First try with helvetica as a safe default
+                            page.insert_text(
+                                origin,
+                                text,
+                                fontsize=font_size,
+                                fontname="helvetica",
+                                color=text_rgb
+                            )
+                        except Exception as font_error:
+                            # If that fails, try other fallback fonts
+                            success = False
+                            for font in fallback_fonts:
+                                if font == "helvetica":  # Already tried
+                                    continue
+                                try:
+                                    page.insert_text(
+                                        origin,
+                                        text,
+                                        fontsize=font_size,
+                                        fontname=font,
+                                        color=text_rgb
+                                    )
+                                    success = True
+                                    break
+                                except:
+                                    continue
+
+                            # If all fallbacks fail, log the error but continue processing
+                            if not success:
+                                print(f"Could not render text: {text}")
+
+    metrics.record_stage("recolor", time.perf_counter() - recolor_start, "customize")
+    metrics.increment("pdf_pages_processed_total", len(doc), operation="customize")
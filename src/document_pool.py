@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import threading
+import contextlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pymupdf
+
+from src import metrics
+from src.operations import apply_operation
+from src.scheduler import JobCost, estimate_document_cost, estimate_open_document_render_cost
+
+# Open documents kept per worker process
+DOC_POOL_SIZE = int(os.environ.get("DOC_POOL_SIZE", "8"))
+# Open documents unused for this long are closed
+DOC_POOL_IDLE_SECONDS = float(os.environ.get("DOC_POOL_IDLE_SECONDS", "600"))
+# Sessions untouched for this long are deleted from disk
+SESSION_EXPIRY_SECONDS = 24 * 60 * 60
+
+
+class DocumentSession:
+    """
+    A document being edited across several requests.
+
+    The original upload and the list of applied operations (the journal) live on
+    disk, so any worker can serve the session: a worker that has the document open
+    only applies journal entries it has not seen yet, and a worker that does not
+    opens the original and replays the journal.
+    """
+
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        self.doc = None
+        self.applied = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def original_path(self):
+        return os.path.join(self.session_dir, "original.pdf")
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.session_dir, "operations.json")
+
+    def read_journal(self):
+        with open(self.journal_path) as f:
+            return json.load(f)
+
+    def write_journal(self, journal):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(journal, f)
+        os.replace(tmp_path, self.journal_path)
+
+    def close(self):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+            self.applied = 0
+
+
+class DocumentPool:
+    """
+    Keeps open PyMuPDF documents for edit sessions, bounded by an LRU size and an idle timeout.
+
+    With a scheduler, replaying a journal runs as an admitted job, and the memory of
+    every open document is held against the scheduler's budget until it is closed.
+    """
+
+    def __init__(self, root, max_documents=DOC_POOL_SIZE, idle_timeout=DOC_POOL_IDLE_SECONDS, scheduler=None):
+        self.root = root
+        self.max_documents = max_documents
+        self.idle_timeout = idle_timeout
+        self.scheduler = scheduler
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper_pid = None
+        os.makedirs(root, exist_ok=True)
+
+    def _session_dir(self, session_id):
+        if len(session_id) != 32 or not all(c in "0123456789abcdef" for c in session_id):
+            raise LookupError("Session not found")
+        return os.path.join(self.root, session_id)
+
+    def create(self, source_path, filename):
+        """
+        Starts a session from an uploaded file, which is moved into the session.
+        :return: The new session id.
+        """
+        self._cleanup_expired()
+        session_id = uuid.uuid4().hex
+        session_dir = self._session_dir(session_id)
+        os.makedirs(session_dir)
+        session = DocumentSession(session_dir)
+        os.replace(source_path, session.original_path)
+        session.write_journal([])
+        with open(os.path.join(session_dir, "meta.json"), "w") as f:
+            json.dump({"filename": filename}, f)
+        return session_id
+
+    def filename(self, session_id):
+        with open(os.path.join(self._session_dir(session_id), "meta.json")) as f:
+            return json.load(f)["filename"]
+
+    @contextmanager
+    def checkout(self, session_id):
+        """
+        Gives exclusive access to a session's open document, up to date with its journal.
+        Other workers are locked out of the session through a file lock.
+        :raises LookupError: If the session does not exist.
+        """
+        session_dir = self._session_dir(session_id)
+        if not os.path.isdir(session_dir):
+            raise LookupError("Session not found")
+
+        self._start_sweeper()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = DocumentSession(session_dir)
+            self._sessions.move_to_end(session_id)
+
+        with session.lock, open(os.path.join(session_dir, "lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            journal = session.read_journal()
+            if session.doc is None or session.applied > len(journal):
+                self._close(session)
+                metrics.increment("cache_misses_total", cache="document_pool")
+                with metrics.stage("open", "session"):
+                    session.doc = pymupdf.open(session.original_path)
+                if self.scheduler is not None:
+                    self.scheduler.hold(session_id, estimate_document_cost(os.path.getsize(session.original_path)).memory_bytes)
+            else:
+                metrics.increment("cache_hits_total", cache="document_pool")
+            # Catch up with operations recorded by other workers
+            pending = journal[session.applied:]
+            if pending:
+                try:
+                    with self._admit_replay(session, pending):
+                        for op in pending:
+                            session.doc = apply_operation(session.doc, op)
+                except Exception:
+                    self._close(session)
+                    raise
+            session.applied = len(journal)
+
+            try:
+                yield session
+            finally:
+                session.last_used = time.monotonic()
+
+        self._evict()
+
+    def apply(self, session, op):
+        """
+        Applies an operation to a checked-out session and records it in the journal.
+        """
+        try:
+            session.doc = apply_operation(session.doc, op)
+        except Exception:
+            # The document may be half-modified; reopen and replay on next checkout
+            self._close(session)
+            raise
+        journal = session.read_journal()
+        journal.append(op)
+        session.write_journal(journal)
+        session.applied = len(journal)
+
+    def delete(self, session_id):
+        session_dir = self._session_dir(session_id)
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            with session.lock:
+                self._close(session)
+        # Wait for a checkout in another worker to finish before removing the files
+        try:
+            with open(os.path.join(session_dir, "lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                shutil.rmtree(session_dir, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+    def _admit_replay(self, session, ops):
+        """
+        Admits replaying journal entries as one job; inverts are priced as renders.
+        """
+        if self.scheduler is None:
+            return contextlib.nullcontext()
+        size = os.path.getsize(session.original_path)
+        inverts = sum(1 for op in ops if op.get("operation") == "invert")
+        if inverts:
+            render = estimate_open_document_render_cost(session.doc, size)
+            cost = JobCost(render.memory_bytes, render.work * inverts)
+        else:
+            cost = estimate_document_cost(size)
+        return self.scheduler.admit(cost, "session_replay")
+
+    def _close(self, session):
+        if session.doc is not None and self.scheduler is not None:
+            self.scheduler.release(os.path.basename(session.session_dir))
+        session.close()
+
+    def _start_sweeper(self):
+        # One thread per worker process closes idle documents even when no requests arrive
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        interval = max(1.0, min(self.idle_timeout / 4, 60.0))
+        threading.Thread(target=self._sweep, args=(interval,), daemon=True, name="document-pool-sweeper").start()
+
+    def _sweep(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self._evict()
+            except Exception as e:
+                print(f"Error closing idle documents: {e}")
+
+    def _evict(self):
+        # Close idle documents and the least recently used ones beyond the pool size
+        now = time.monotonic()
+        with self._lock:
+            open_ids = [sid for sid, s in self._sessions.items() if s.doc is not None]
+            excess = len(open_ids) - self.max_documents
+            for session_id in open_ids:
+                session = self._sessions[session_id]
+                if excess <= 0 and now - session.last_used < self.idle_timeout:
+                    continue
+                # Skip sessions that are in use right now
+                if not session.lock.acquire(blocking=False):
+                    continue
+                try:
+                    self._close(session)
+                    excess -= 1
+                finally:
+                    session.lock.release()
+            for session_id in [sid for sid, s in self._sessions.items() if s.doc is None]:
+                del self._sessions[session_id]
+            metrics.set_gauge("document_pool_open_documents", len(self._sessions))
+
+    def _cleanup_expired(self):
+        cutoff = time.time() - SESSION_EXPIRY_SECONDS
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    self.delete(name)
+            except (OSError, LookupError):
+                pass
+
+
+metrics.describe("document_pool_open_documents", "Documents held open by the session pool.")
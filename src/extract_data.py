@@ -2,15 +2,32 @@ import os
 import re
 import fitz
 import json
+import asyncio
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from mistralai import Mistral, DocumentURLChunk, ImageURLChunk, TextChunk
 from mistralai.models import OCRResponse
 from dotenv import load_dotenv
 
+from src import metrics
+from src.profiling import profiled
+from src.ocr_payload import prepare_ocr_payload
+from src.structuring import split_markdown, merge_partials, missing_fields, STRUCTURE_CONCURRENCY
+
 load_dotenv()
 
 api_key = os.environ["MISTRAL_API_KEY"]
-client = Mistral(api_key=api_key)
+# Point the client at another server, e.g. loadtest/fake_mistral.py
+server_url = os.environ.get("MISTRAL_SERVER_URL") or None
+client = Mistral(api_key=api_key, server_url=server_url)
+
+# Documents extracted at the same time by one batch on the async path
+EXTRACT_BATCH_CONCURRENCY = int(os.environ.get("EXTRACT_BATCH_CONCURRENCY", "8"))
+# Extractions in flight across the whole process on the async path
+EXTRACT_MAX_IN_FLIGHT = int(os.environ.get("EXTRACT_MAX_IN_FLIGHT", "256"))
+
+# Created by start_async_extraction on the serving event loop
+_in_flight = None
 
 def replace_images_in_markdown(markdown_str: str, images_dict: dict) -> str:
     """
@@ -29,15 +46,15 @@ def replace_images_in_markdown(markdown_str: str, images_dict: dict) -> str:
         )
     return markdown_str
 
-def get_combined_markdown(ocr_response: OCRResponse) -> str:
+def get_page_markdowns(ocr_response: OCRResponse) -> list[str]:
     """
-    Combine OCR text and images into a single markdown document.
+    Get the markdown of each page with images filled in.
 
     Args:
         ocr_response: Response from OCR processing containing text and images
 
     Returns:
-        Combined markdown string with embedded images
+        List of markdown strings, one per page
     """
     markdowns: list[str] = []
     # Extract images from page
@@ -47,17 +64,30 @@ def get_combined_markdown(ocr_response: OCRResponse) -> str:
             image_data[img.id] = img.image_base64
         # Replace image placeholders with actual images
         markdowns.append(replace_images_in_markdown(page.markdown, image_data))
+    return markdowns
+
+def get_combined_markdown(ocr_response: OCRResponse) -> str:
+    """
+    Combine OCR text and images into a single markdown document.
 
-    return "\n\n".join(markdowns)
+    Args:
+        ocr_response: Response from OCR processing containing text and images
+
+    Returns:
+        Combined markdown string with embedded images
+    """
+    return "\n\n".join(get_page_markdowns(ocr_response))
 
-def get_ocr_response(pdf_file):
+def get_ocr_response(pdf_file, fields_to_extract=None):
     pdf_file = Path(pdf_file)
+    # Downsampled images and only the relevant pages upload much faster
+    content = prepare_ocr_payload(pdf_file, fields_to_extract)
     
     # Upload PDF file to Mistral's OCR service
     uploaded_file = client.files.upload(
         file={
             "file_name": pdf_file.stem,
-            "content": pdf_file.read_bytes(),
+            "content": content,
         },
         purpose="ocr",
     )
@@ -74,40 +104,41 @@ def get_ocr_response(pdf_file):
     
     return pdf_response
 
-def get_prompt_for_markdown(markdown, fields_to_extract=None):
+def get_prompt_for_markdown(markdown, fields_to_extract=None, known_keys=None):
     if fields_to_extract is None:
+        # Later chunks of a document reuse the keys found in its first chunk
+        key_hint = (
+            f"Where they apply, use these keys: {', '.join(known_keys)}. "
+            if known_keys else ""
+        )
         return (
             f"This is document's OCR in markdown:\n\n{markdown}\n.\n"
             "Convert this into a sensible structured json response. "
+            f"{key_hint}"
             "The output should be strictly be json with no extra commentary"
         )
     else:
         return (
             f"This is document's OCR in markdown:\n\n{markdown}\n.\n"
             "Convert this into a sensible structured json response. "
-            f"Extract the following fields: {', '.join(fields_to_extract)}"
+            f"Extract the following fields: {', '.join(fields_to_extract)}. "
             "If given fields are not present in the document, return an empty string for that field. "
             "The output should be strictly be json with no extra commentary"
         )
 
-def jsonify_ocr_response(markdown, prompt):
+def get_chat_messages(prompt):
+    return [
+        {
+            "role": "user",
+            "content": [TextChunk(text=prompt)],
+        }
+    ]
+
+def jsonify_ocr_response(prompt):
     # Get structured response from model
     chat_response = client.chat.complete(
         model="ministral-8b-latest",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    TextChunk(
-                        text=(
-                            f"This is document's OCR in markdown:\n\n{markdown}\n.\n"
-                            "Convert this into a sensible structured json response. "
-                            "The output should be strictly be json with no extra commentary"
-                        )
-                    ),
-                ],
-            }
-        ],
+        messages=get_chat_messages(prompt),
         response_format={"type": "json_object"},
         temperature=0,
     )
@@ -117,6 +148,84 @@ def jsonify_ocr_response(markdown, prompt):
     
     return response_dict
 
+def plan_structuring(page_markdowns, fields_to_extract=None):
+    """
+    Drives chunked structuring of a document (map-reduce over page chunks).
+
+    A generator shared by the sync and async paths: it yields lists of prompts to
+    run concurrently and is sent back their results (dicts, or exceptions for
+    failed requests). Requested fields are looked for chunk by chunk in waves, in
+    document order, stopping once every field has a value. Without requested fields
+    the first chunk is structured on its own and its keys are suggested for the rest.
+
+    Args:
+        page_markdowns: List of markdown strings, one per page
+        fields_to_extract: List of field names to extract (if None, extract all detected fields)
+
+    Returns:
+        The merged result (as the generator's return value)
+    """
+    chunks = split_markdown(page_markdowns)
+    partials = []
+    errors = []
+
+    def collect(results):
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                partials.append(result)
+
+    if fields_to_extract:
+        position = 0
+        missing = list(fields_to_extract)
+        while position < len(chunks) and missing:
+            wave = chunks[position:position + STRUCTURE_CONCURRENCY]
+            position += len(wave)
+            collect((yield [get_prompt_for_markdown(chunk, missing) for chunk in wave]))
+            missing = missing_fields(merge_partials(partials, fields_to_extract), fields_to_extract)
+        metrics.increment("llm_chunks_total", position, outcome="structured")
+        metrics.increment("llm_chunks_total", len(chunks) - position, outcome="skipped")
+    else:
+        collect((yield [get_prompt_for_markdown(chunks[0])]))
+        if len(chunks) > 1:
+            known_keys = list(partials[0]) if partials else None
+            collect((yield [get_prompt_for_markdown(chunk, known_keys=known_keys) for chunk in chunks[1:]]))
+        metrics.increment("llm_chunks_total", len(chunks), outcome="structured")
+
+    for error in errors:
+        print(f"Error structuring a chunk: {str(error)}")
+    if errors and not partials:
+        raise errors[0]
+    return merge_partials(partials, fields_to_extract)
+
+def _complete_or_error(prompt):
+    try:
+        return jsonify_ocr_response(prompt)
+    except Exception as e:
+        return e
+
+def structure_ocr_response(ocr_response, fields_to_extract=None):
+    """
+    Turn OCR output into JSON, structuring long documents in parallel chunks.
+
+    Args:
+        ocr_response: Response from OCR processing
+        fields_to_extract: List of field names to extract (if None, extract all detected fields)
+
+    Returns:
+        Dictionary containing extracted data
+    """
+    plan = plan_structuring(get_page_markdowns(ocr_response), fields_to_extract)
+    with ThreadPoolExecutor(max_workers=STRUCTURE_CONCURRENCY) as pool:
+        try:
+            prompts = next(plan)
+            while True:
+                prompts = plan.send(list(pool.map(_complete_or_error, prompts)))
+        except StopIteration as done:
+            return done.value
+
+@profiled("extract")
 def extract_data_from_pdf(pdf_path, fields_to_extract=None):
     """
     Extract data from a PDF file.
@@ -126,19 +235,160 @@ def extract_data_from_pdf(pdf_path, fields_to_extract=None):
         fields_to_extract: List of field names to extract (if None, extract all detected fields)
     
     Returns:
-        Dictionary containing extracted data
+        Dictionary containing extracted data, empty if extraction failed
+    """
+    data, _ = extract_data_with_error(pdf_path, fields_to_extract)
+    return data
+
+
+def extract_data_with_error(pdf_path, fields_to_extract=None):
+    """
+    Same as extract_data_from_pdf, but also reports why extraction failed.
+
+    Returns:
+        Tuple of (extracted data, error message or None)
     """
     try:
         if fields_to_extract:
             print(f"Extracting data from {pdf_path} with fields_to_extract: {fields_to_extract}")
         else:
             print(f"Extracting data from {pdf_path} w/o fields_to_extract")
-        ocr_response = get_ocr_response(pdf_path)
-        combined_markdown = get_combined_markdown(ocr_response)
-        prompt = get_prompt_for_markdown(combined_markdown, fields_to_extract)
-        json_response = jsonify_ocr_response(combined_markdown, prompt=prompt)
+        with metrics.stage("ocr", "extract"):
+            ocr_response = get_ocr_response(pdf_path, fields_to_extract)
+        metrics.increment("pdf_pages_processed_total", len(ocr_response.pages), operation="extract")
+        with metrics.stage("llm", "extract"):
+            json_response = structure_ocr_response(ocr_response, fields_to_extract)
         
-        return json_response
+        return json_response, None
     except Exception as e:
         print(f"Error extracting data from {pdf_path}: {str(e)}")
-        return {}
\ No newline at end of file
+        return {}, str(e)
+
+
+# Async versions of the extraction flow. They use the SDK's async methods, so a
+# single event loop can keep many extractions waiting on the API at once.
+
+def start_async_extraction():
+    """
+    Sets up the process-wide limit of extractions in flight. Call it from the ASGI
+    lifespan startup, on the event loop that serves the requests.
+    """
+    global _in_flight
+    _in_flight = asyncio.Semaphore(EXTRACT_MAX_IN_FLIGHT)
+
+async def get_ocr_response_async(pdf_file, fields_to_extract=None):
+    pdf_file = Path(pdf_file)
+    content = await asyncio.to_thread(prepare_ocr_payload, pdf_file, fields_to_extract)
+
+    uploaded_file = await client.files.upload_async(
+        file={
+            "file_name": pdf_file.stem,
+            "content": content,
+        },
+        purpose="ocr",
+    )
+    signed_url = await client.files.get_signed_url_async(file_id=uploaded_file.id, expiry=1)
+    return await client.ocr.process_async(
+        document=DocumentURLChunk(document_url=signed_url.url),
+        model="mistral-ocr-latest",
+        include_image_base64=False
+    )
+
+async def jsonify_ocr_response_async(prompt):
+    chat_response = await client.chat.complete_async(
+        model="ministral-8b-latest",
+        messages=get_chat_messages(prompt),
+        response_format={"type": "json_object"},
+        temperature=0,
+    )
+    return json.loads(chat_response.choices[0].message.content)
+
+async def structure_ocr_response_async(ocr_response, fields_to_extract=None):
+    """
+    Async version of structure_ocr_response.
+    """
+    limit = asyncio.Semaphore(STRUCTURE_CONCURRENCY)
+
+    async def complete(prompt):
+        async with limit:
+            try:
+                return await jsonify_ocr_response_async(prompt)
+            except Exception as e:
+                return e
+
+    plan = plan_structuring(get_page_markdowns(ocr_response), fields_to_extract)
+    try:
+        prompts = next(plan)
+        while True:
+            prompts = plan.send(await asyncio.gather(*(complete(prompt) for prompt in prompts)))
+    except StopIteration as done:
+        return done.value
+
+async def extract_data_from_pdf_async(pdf_path, fields_to_extract=None):
+    """
+    Async version of extract_data_from_pdf.
+
+    Args:
+        pdf_path: Path to the PDF file
+        fields_to_extract: List of field names to extract (if None, extract all detected fields)
+
+    Returns:
+        Dictionary containing extracted data, empty if extraction failed
+    """
+    data, _ = await extract_data_with_error_async(pdf_path, fields_to_extract)
+    return data
+
+@profiled("extract")
+async def extract_data_with_error_async(pdf_path, fields_to_extract=None):
+    """
+    Async version of extract_data_with_error.
+
+    Returns:
+        Tuple of (extracted data, error message or None)
+    """
+    try:
+        if fields_to_extract:
+            print(f"Extracting data from {pdf_path} with fields_to_extract: {fields_to_extract}")
+        else:
+            print(f"Extracting data from {pdf_path} w/o fields_to_extract")
+        if _in_flight is None:
+            raise RuntimeError("Async extraction was not started; call start_async_extraction at startup")
+        async with _in_flight:
+            with metrics.stage("ocr", "extract"):
+                ocr_response = await get_ocr_response_async(pdf_path, fields_to_extract)
+            metrics.increment("pdf_pages_processed_total", len(ocr_response.pages), operation="extract")
+            with metrics.stage("llm", "extract"):
+                return await structure_ocr_response_async(ocr_response, fields_to_extract), None
+    except Exception as e:
+        print(f"Error extracting data from {pdf_path}: {str(e)}")
+        return {}, str(e)
+
+async def extract_batch_async(pdf_paths, fields_to_extract=None, concurrency=EXTRACT_BATCH_CONCURRENCY):
+    """
+    Extracts data from several PDFs concurrently.
+
+    Args:
+        pdf_paths: Paths to the PDF files
+        fields_to_extract: List of field names to extract (if None, extract all detected fields)
+        concurrency: Maximum number of documents of this batch in flight at once
+
+    Yields:
+        (index, path, data, error) tuples in completion order; error is None on success
+    """
+    batch_limit = asyncio.Semaphore(concurrency)
+
+    async def extract(index, path):
+        async with batch_limit:
+            return (index, path) + await extract_data_with_error_async(path, fields_to_extract)
+
+    tasks = [asyncio.ensure_future(extract(index, path)) for index, path in enumerate(pdf_paths)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The consumer stopped early (e.g. the client disconnected)
+        for task in tasks:
+            task.cancel()
+
+
+metrics.describe("llm_chunks_total", "Document chunks sent to (structured) or skipped by (skipped) the structuring model.")
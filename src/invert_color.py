@@ -1,30 +1,43 @@
+import os
+import math
 from io import BytesIO
 from PIL import Image
 import pymupdf
 import numpy as np
 
+from src import metrics
+from src.profiling import profiled
+from src.pdf_output import save_pdf
 
-def invert_pdf_colors(input_pdf_path, output_pdf_path):
+# Longest side (in pixels) of the thumbnail used to judge page brightness
+THUMBNAIL_SIZE = 64
+# Pages whose mean luminance (0-255) falls below this are treated as dark
+DARK_LUMINANCE_THRESHOLD = 128
+
+INVERT_MODES = ("all", "auto")
+
+# Memory budget for rendering a single page (or tile), in bytes
+MAX_RENDER_BYTES = int(os.environ.get("MAX_RENDER_MB", "256")) * 1024 * 1024
+# Pixmap, PIL image, numpy copies and PNG buffer are alive at the same time
+RENDER_MEMORY_FACTOR = 4
+
+
+@profiled("invert")
+def invert_pdf_colors(input_pdf_path, output_pdf_path, mode="all"):
+    """
+    Inverts the colors of a PDF.
+    :param input_pdf_path: Path to the input PDF.
+    :param output_pdf_path: Path where the output PDF will be saved.
+    :param mode: "all" inverts every page, "auto" only inverts dark pages and
+        copies the remaining pages through unchanged.
+    """
     try:
-        document = pymupdf.open(input_pdf_path)
-        new_pdf = pymupdf.open()
+        with metrics.stage("open", "invert"):
+            document = pymupdf.open(input_pdf_path)
+        new_pdf = invert_document(document, mode)
         
-        # Increase Image Resolution
-        mat = pymupdf.Matrix(2, 2) # zoom x, zoom y
-        
-        for page in document:
-            pix = page.get_pixmap(matrix=mat)
-            inverted_image = invert_image_colors(pix)
-            
-            buffer = BytesIO()
-            inverted_image.save(buffer, format="PNG", quality=150)
-            buffer.seek(0)
-            
-            rect = page.rect
-            new_page = new_pdf.new_page(width=rect.width, height=rect.height)
-            new_page.insert_image(rect, stream=buffer.read())
-        
-        new_pdf.save(output_pdf_path)
+        with metrics.stage("save", "invert"):
+            save_pdf(new_pdf, output_pdf_path)
         new_pdf.close()
         document.close()
         return True
@@ -32,6 +45,124 @@ def invert_pdf_colors(input_pdf_path, output_pdf_path):
         print(f"Error processing PDF: {e}")
         return False
 
+def invert_document(document, mode="all"):
+    """
+    Builds a new document with the colors of every (or every dark) page inverted.
+    :param document: An open PyMuPDF Document; it is not modified.
+    :param mode: "all" or "auto", see invert_pdf_colors.
+    :return: A new PyMuPDF Document.
+    """
+    new_pdf = pymupdf.open()
+    
+    # Increase Image Resolution
+    mat = pymupdf.Matrix(2, 2) # zoom x, zoom y
+    
+    for page in document:
+        dark = True
+        # The page itself renders when every page is inverted; in auto mode its content
+        # is interpreted once into a display list that both the brightness check and
+        # the full render reuse
+        source = page
+        if mode == "auto":
+            with metrics.stage("analyze", "invert"):
+                source = page.get_displaylist()
+                dark = is_dark_page(page, display_list=source)
+        if not dark:
+            # Light pages keep their original content, no render needed
+            with metrics.stage("insert", "invert"):
+                new_pdf.insert_pdf(document, from_page=page.number, to_page=page.number)
+            metrics.increment("pdf_pages_processed_total", operation="invert", action="copied")
+            continue
+
+        rect = page.rect
+        new_page = new_pdf.new_page(width=rect.width, height=rect.height)
+
+        # Oversized pages are rendered in tiles to stay within the budget
+        for clip in page_tiles(page, mat):
+            with metrics.stage("render", "invert"):
+                pix = source.get_pixmap(matrix=mat, clip=clip)
+            with metrics.stage("invert", "invert"):
+                inverted_image = invert_image_colors(pix)
+            pix = None
+
+            with metrics.stage("encode", "invert"):
+                buffer = BytesIO()
+                inverted_image.save(buffer, format="PNG", quality=150)
+                buffer.seek(0)
+
+            with metrics.stage("insert", "invert"):
+                new_page.insert_image(clip, stream=buffer.read())
+        metrics.increment("pdf_pages_processed_total", operation="invert", action="inverted")
+    
+    return new_pdf
+
+def page_tiles(page, matrix, max_bytes=MAX_RENDER_BYTES):
+    """
+    Splits a page into clip rectangles that can each be rendered within a memory budget.
+    :param page: A PyMuPDF Page object.
+    :param matrix: The PyMuPDF Matrix the page will be rendered with.
+    :param max_bytes: Memory budget for rendering a single tile.
+    :return: List of PyMuPDF Rect objects in page coordinates.
+    """
+    rect = page.rect
+    zoom_x, zoom_y = abs(matrix.a) or 1, abs(matrix.d) or 1
+    width_px = math.ceil(rect.width * zoom_x)
+    height_px = math.ceil(rect.height * zoom_y)
+    max_pixels = max(1, max_bytes // (3 * RENDER_MEMORY_FACTOR))
+
+    if width_px * height_px <= max_pixels:
+        return [rect]
+
+    # Full-width bands, as tall as the budget allows; only pages with a single pixel
+    # row over the budget are split into a grid of roughly square tiles
+    if width_px <= max_pixels:
+        cols = 1
+    else:
+        cols = math.ceil(width_px / max(1, math.isqrt(max_pixels)))
+    tile_w = math.ceil(width_px / cols)
+    tile_h = max(1, max_pixels // tile_w)
+    rows = math.ceil(height_px / tile_h)
+
+    tiles = []
+    for row in range(rows):
+        y0 = rect.y0 + row * tile_h / zoom_y
+        y1 = min(rect.y1, rect.y0 + (row + 1) * tile_h / zoom_y)
+        for col in range(cols):
+            x0 = rect.x0 + col * tile_w / zoom_x
+            x1 = min(rect.x1, rect.x0 + (col + 1) * tile_w / zoom_x)
+            tiles.append(pymupdf.Rect(x0, y0, x1, y1))
+    return tiles
+
+
+def page_luminance(page, display_list=None):
+    """
+    Estimates the mean luminance of a page from a low-resolution render.
+    :param page: A PyMuPDF Page object.
+    :param display_list: The page's DisplayList, rendered instead of the page if given.
+    :return: Mean luminance between 0 (black) and 255 (white).
+    """
+    rect = page.rect
+    zoom = THUMBNAIL_SIZE / max(rect.width, rect.height, 1)
+    pix = (page if display_list is None else display_list).get_pixmap(
+        matrix=pymupdf.Matrix(zoom, zoom), colorspace=pymupdf.csGRAY, alpha=False
+    )
+    samples = np.frombuffer(pix.samples, dtype=np.uint8)
+    if samples.size == 0:
+        return 255.0
+    return float(samples.mean())
+
+
+def is_dark_page(page, threshold=DARK_LUMINANCE_THRESHOLD, display_list=None):
+    """
+    Decides whether a page has a dark background and should be inverted.
+    :param page: A PyMuPDF Page object.
+    :param threshold: Mean luminance below which the page counts as dark.
+    :param display_list: The page's DisplayList, rendered instead of the page if given.
+    :return: True if the page is dark.
+    """
+    return page_luminance(page, display_list) < threshold
+
+
 def invert_image_colors(pixmap):
     """
     Inverts the colors of an image.
@@ -44,22 +175,43 @@ def invert_image_colors(pixmap):
     return Image.fromarray(inverted_array.astype('uint8'))
 
 
+@profiled("remove")
 def remove_pages(input_pdf, output_pdf, pages_to_remove):
+    pages_to_remove = parse_page_ranges(pages_to_remove)
+    
+    with metrics.stage("open", "remove"):
+        doc = pymupdf.open(input_pdf)
+    
+    delete_pages(doc, pages_to_remove)
+
+    # Save the modified PDF
+    with metrics.stage("save", "remove"):
+        save_pdf(doc, output_pdf)
+    doc.close()
+
+def parse_page_ranges(pages_to_remove):
+    """
+    Parses a page selection such as "3-5" or "1,4,7".
+    :param pages_to_remove: Page selection using 1-based page numbers.
+    :return: List of 0-based page numbers.
+    """
     if '-' in pages_to_remove:
         start, end = pages_to_remove.split('-')
         pages_to_remove = range(int(start), int(end) + 1)
     else:
         pages_to_remove = [int(p) for p in pages_to_remove.split(',')]
         
-    pages_to_remove = [p - 1 for p in pages_to_remove]  # Convert to 0-based indexing
-    
-    doc = pymupdf.open(input_pdf)
-    
-    # Delete pages (PyMuPDF uses 0-based indexing)
-    for page_num in sorted(pages_to_remove, reverse=True):
-        if 0 <= page_num < len(doc):
-            doc.delete_page(page_num)
+    return [p - 1 for p in pages_to_remove]  # Convert to 0-based indexing
 
-    # Save the modified PDF
-    doc.save(output_pdf)
-    doc.close()
\ No newline at end of file
+def delete_pages(doc, pages_to_remove):
+    """
+    Deletes pages from an open document, ignoring page numbers that do not exist.
+    :param doc: A PyMuPDF Document.
+    :param pages_to_remove: 0-based page numbers.
+    """
+    # Delete pages (PyMuPDF uses 0-based indexing)
+    with metrics.stage("delete", "remove"):
+        for page_num in sorted(set(pages_to_remove), reverse=True):
+            if 0 <= page_num < len(doc):
+                doc.delete_page(page_num)
+    metrics.increment("pdf_pages_processed_total", len(doc), operation="remove")
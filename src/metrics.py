@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) for request and stage durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Directory where every worker process writes its metrics, so /metrics served by
+# any worker reports the totals of all of them. Unset: /metrics reports the metrics
+# of the process serving it, which is only complete with a single worker.
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+# Seconds between writes of a worker's metrics to METRICS_DIR; a scrape is at most
+# this far behind for the workers that did not serve it
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+# How the values of a gauge from several workers are combined
+GAUGE_MERGE_MODES = ("sum", "max", "latest")
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_gauge_times = {}
+_histograms = {}
+_help = {}
+_gauge_merge = {}
+_process = {"pid": None, "path": None, "dirty": False, "flusher_pid": None}
+
+# Per-request stage timings, so they can be attached to the request log line.
+# A context variable rather than a thread local, so concurrent async requests
+# served by one thread keep separate timings.
+_timings = contextvars.ContextVar("request_timings", default=None)
+# Per-request totals for the request log line, e.g. bytes uploaded for OCR
+_details = contextvars.ContextVar("request_details", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name, text, merge="sum"):
+    """
+    Registers the HELP text shown for a metric on /metrics.
+    :param merge: For gauges, how values of several workers are combined with METRICS_DIR:
+        "sum" for per-process quantities, "max", or "latest" for values every worker
+        reads from shared state (the most recently set value wins).
+    """
+    if merge not in GAUGE_MERGE_MODES:
+        raise ValueError(f"Unknown merge mode, expected one of: {', '.join(GAUGE_MERGE_MODES)}")
+    _help[name] = text
+    _gauge_merge[name] = merge
+
+
+def increment(name, value=1, **labels):
+    """
+    Increments a counter.
+    :param name: Metric name, e.g. "pdf_pages_processed_total".
+    :param value: Amount to add.
+    :param labels: Prometheus labels for the series.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _process["dirty"] = True
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a gauge to an absolute value.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+        _gauge_times[key] = time.time()
+        _process["dirty"] = True
+
+
+def add_gauge(name, value, **labels):
+    """
+    Adds to (or subtracts from) a gauge.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+        _gauge_times[key] = time.time()
+        _process["dirty"] = True
+
+
+def observe(name, value, **labels):
+    """
+    Records a value in a histogram.
+    """
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+        _process["dirty"] = True
+
+
+def begin_request():
+    """
+    Starts collecting stage timings and details for the current request.
+    """
+    _start_flusher()
+    _timings.set({})
+    _details.set({})
+
+
+def end_request():
+    """
+    Stops collecting stage timings and details for the current request.
+    :return: Dictionary mapping stage name to total seconds spent in it.
+    """
+    timings = _timings.get() or {}
+    _timings.set(None)
+    _details.set(None)
+    return timings
+
+
+def add_request_details(**values):
+    """
+    Adds numbers to the current request's log line; values recorded several times
+    in one request (e.g. once per document of a batch) are summed.
+    """
+    details = _details.get()
+    if details is None:
+        return
+    for name, value in values.items():
+        details[name] = details.get(name, 0) + value
+
+
+def request_details():
+    """
+    :return: Dictionary of the details recorded for the current request so far.
+    """
+    return dict(_details.get() or {})
+
+
+@contextmanager
+def stage(name, operation=""):
+    """
+    Times a processing stage (open, render, invert, encode, insert, save, ocr, llm, ...).
+    :param name: Stage name.
+    :param operation: Operation the stage belongs to, e.g. "invert" or "extract".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start, operation)
+
+
+def record_stage(name, seconds, operation=""):
+    """
+    Records a stage duration measured by the caller.
+    :param name: Stage name.
+    :param seconds: Time spent in the stage.
+    :param operation: Operation the stage belongs to.
+    """
+    observe("pdf_stage_seconds", seconds, stage=name, operation=operation)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def _process_path():
+    # Named per process start rather than by pid alone, so a new worker that
+    # reuses a pid does not overwrite the counters of the one that exited
+    if _process["pid"] != os.getpid() or os.path.dirname(_process["path"]) != METRICS_DIR:
+        _process["pid"] = os.getpid()
+        _process["path"] = os.path.join(METRICS_DIR, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        _process["dirty"] = True
+    return _process["path"]
+
+
+def _start_flusher():
+    # One thread per worker process writes its metrics, so requests never wait on disk I/O
+    if METRICS_DIR is None or _process["flusher_pid"] == os.getpid():
+        return
+    with _lock:
+        if _process["flusher_pid"] == os.getpid():
+            return
+        _process["flusher_pid"] = os.getpid()
+    threading.Thread(target=_flush_periodically, daemon=True, name="metrics-flusher").start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+
+def flush():
+    """
+    Writes this process's metrics to METRICS_DIR if they changed since the last flush.
+    Called every METRICS_FLUSH_INTERVAL seconds, at scrape time and at exit; does
+    nothing without METRICS_DIR.
+    """
+    if METRICS_DIR is None:
+        return
+    with _lock:
+        path = _process_path()
+        if not _process["dirty"]:
+            return
+        snapshot = {
+            "pid": os.getpid(),
+            "counters": [[name, labels, value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, labels, value, _gauge_times.get((name, labels), 0)]
+                       for (name, labels), value in _gauges.items()],
+            "histograms": [[name, labels, hist] for (name, labels), hist in _histograms.items()],
+        }
+        _process["dirty"] = False
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+# Counters of the last requests before a worker exits are not lost
+atexit.register(flush)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _collect_all_processes():
+    """
+    Merges the snapshots of all worker processes in METRICS_DIR.
+    Counters and histograms of workers that exited are kept, so totals never go
+    down; gauges only come from live workers.
+    :return: Tuple of (counters, gauges, histograms) dicts keyed like the local ones.
+    """
+    counters = {}
+    gauges = {}
+    gauge_times = {}
+    histograms = {}
+    for filename in sorted(os.listdir(METRICS_DIR)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        for name, labels, value in snapshot["counters"]:
+            key = name, tuple(tuple(pair) for pair in labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, hist in snapshot["histograms"]:
+            key = name, tuple(tuple(pair) for pair in labels)
+            merged = histograms.setdefault(key, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0})
+            merged["buckets"] = [a + b for a, b in zip(merged["buckets"], hist["buckets"])]
+            merged["sum"] += hist["sum"]
+            merged["count"] += hist["count"]
+        if not _pid_alive(snapshot["pid"]):
+            continue
+        for name, labels, value, updated in snapshot["gauges"]:
+            key = name, tuple(tuple(pair) for pair in labels)
+            mode = _gauge_merge.get(name, "sum")
+            if key not in gauges:
+                gauges[key], gauge_times[key] = value, updated
+            elif mode == "sum":
+                gauges[key] += value
+            elif mode == "max":
+                gauges[key] = max(gauges[key], value)
+            elif updated >= gauge_times[key]:
+                gauges[key], gauge_times[key] = value, updated
+    return counters, gauges, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for k, v in pairs:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus():
+    """
+    Renders metrics in the Prometheus text exposition format: the totals of all
+    worker processes with METRICS_DIR, otherwise this process's own.
+    :return: The metrics as a string.
+    """
+    lines = []
+    if METRICS_DIR is not None:
+        flush()
+        counters, gauges, histograms = _collect_all_processes()
+    else:
+        with _lock:
+            counters, gauges = dict(_counters), dict(_gauges)
+            histograms = {key: dict(hist, buckets=list(hist["buckets"])) for key, hist in _histograms.items()}
+
+    def header(name, kind, seen):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter", seen)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge", seen)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), hist in sorted(histograms.items()):
+        header(name, "histogram", seen)
+        for bound, count in zip(DURATION_BUCKETS, hist["buckets"]):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe("http_requests_total", "HTTP requests by endpoint and status code.")
+describe("http_request_seconds", "HTTP request duration by endpoint.")
+describe("http_requests_in_flight", "Requests currently being processed.")
+describe("http_request_bytes_total", "Request body bytes received by endpoint.")
+describe("http_response_bytes_total", "Response body bytes sent by endpoint.")
+describe("pdf_stage_seconds", "Time spent in each processing stage.")
+describe("pdf_pages_processed_total", "Pages processed by operation.")
+describe("cache_hits_total", "Cache hits by cache.")
+describe("cache_misses_total", "Cache misses by cache.")
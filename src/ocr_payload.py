@@ -0,0 +1,155 @@
+import os
+import re
+
+import pymupdf
+
+from src import metrics
+from src.pdf_output import SAVE_PRESETS
+from src.scheduler import scheduler, estimate_ocr_reduce_cost, AdmissionRejected
+
+# Set to 0 to upload original files to the OCR service unchanged
+OCR_REDUCE_PAYLOAD = os.environ.get("OCR_REDUCE_PAYLOAD", "1") != "0"
+# Embedded images are downsampled to this resolution; OCR gains nothing from more
+OCR_IMAGE_DPI = int(os.environ.get("OCR_IMAGE_DPI", "200"))
+# JPEG quality of downsampled images
+OCR_IMAGE_QUALITY = int(os.environ.get("OCR_IMAGE_QUALITY", "80"))
+# When specific fields are requested, send at most this many pages (0: all pages)
+OCR_MAX_PAGES = int(os.environ.get("OCR_MAX_PAGES", "0"))
+
+
+def select_pages(doc, fields_to_extract=None, max_pages=None):
+    """
+    Chooses the pages worth sending to OCR when only some fields are requested.
+
+    Pages whose text layer mentions a requested field come first, then the first
+    pages of the document fill the remaining slots (scans have no text layer).
+    :param doc: A PyMuPDF Document.
+    :param fields_to_extract: Requested field names, or None for all fields.
+    :param max_pages: Page limit; 0 keeps every page. Defaults to OCR_MAX_PAGES.
+    :return: Sorted list of 0-based page indexes.
+    """
+    if max_pages is None:
+        max_pages = OCR_MAX_PAGES
+    if not fields_to_extract or not max_pages or doc.page_count <= max_pages:
+        return list(range(doc.page_count))
+
+    patterns = [re.compile(re.escape(field).replace(r"\ ", r"\s+"), re.I) for field in fields_to_extract]
+    selected = []
+    for page in doc:
+        if len(selected) >= max_pages:
+            break
+        text = page.get_text()
+        if text and any(pattern.search(text) for pattern in patterns):
+            selected.append(page.number)
+
+    for index in range(doc.page_count):
+        if len(selected) >= max_pages:
+            break
+        if index not in selected:
+            selected.append(index)
+    return sorted(selected)
+
+
+def reduce_document(doc, pages=None, dpi=OCR_IMAGE_DPI, quality=OCR_IMAGE_QUALITY):
+    """
+    Strips what OCR does not need from an open document, in place: pages outside
+    the selection, images above the target resolution, and non-content objects
+    (attachments, scripts, thumbnails, metadata, links and annotations).
+    :param doc: A PyMuPDF Document.
+    :param pages: 0-based page indexes to keep, or None for all pages.
+    :param dpi: Target resolution for embedded images.
+    :param quality: JPEG quality of downsampled images.
+    """
+    if pages is not None and len(pages) < doc.page_count:
+        doc.select(pages)
+
+    doc.scrub(
+        attached_files=True,
+        clean_pages=False,
+        embedded_files=True,
+        hidden_text=False,
+        javascript=True,
+        metadata=True,
+        redactions=False,
+        remove_links=True,
+        reset_fields=False,
+        reset_responses=True,
+        thumbnails=True,
+        xml_metadata=True,
+    )
+    for page in doc:
+        for annot in list(page.annots() or []):
+            # Attachments, sounds and popups hold nothing for OCR to read
+            if annot.type[0] in (pymupdf.PDF_ANNOT_POPUP, pymupdf.PDF_ANNOT_FILE_ATTACHMENT, pymupdf.PDF_ANNOT_SOUND):
+                page.delete_annot(annot)
+
+    # Leave some headroom so images just above the target are not recompressed
+    doc.rewrite_images(dpi_threshold=int(dpi * 1.25), dpi_target=dpi, quality=quality)
+
+
+def prepare_ocr_payload(pdf_path, fields_to_extract=None):
+    """
+    Builds the bytes to upload to the OCR service for a PDF.
+    The original and uploaded sizes and page counts are added to the metrics and
+    to the request log line (ocr_original_bytes, ocr_payload_bytes, ocr_bytes_saved,
+    ocr_pages and ocr_total_pages).
+    :param pdf_path: Path to the PDF file.
+    :param fields_to_extract: Requested field names, used to pick pages (see OCR_MAX_PAGES).
+    :return: The PDF bytes to upload.
+    """
+    with open(pdf_path, "rb") as f:
+        original = f.read()
+    stats = {
+        "original_bytes": len(original),
+        "payload_bytes": len(original),
+        "bytes_saved": 0,
+        "pages": None,
+        "total_pages": None,
+    }
+    if not OCR_REDUCE_PAYLOAD:
+        _record_request_stats(stats)
+        return original
+
+    payload = original
+    try:
+        # Image rewriting is CPU-bound, so it takes its turn with the other processing jobs
+        with scheduler.admit(estimate_ocr_reduce_cost(len(original)), "extract"), \
+                metrics.stage("ocr_reduce", "extract"), \
+                pymupdf.open(stream=original, filetype="pdf") as doc:
+            stats["total_pages"] = stats["pages"] = doc.page_count
+            if not doc.needs_pass:
+                pages = select_pages(doc, fields_to_extract)
+                reduce_document(doc, pages)
+                reduced = doc.tobytes(**SAVE_PRESETS["smallest"])
+                # Already compact files can grow slightly when rewritten
+                if len(reduced) < len(original) or doc.page_count < stats["total_pages"]:
+                    payload = reduced
+                    stats["pages"] = doc.page_count
+    except AdmissionRejected:
+        # Too busy to reduce it now; the original uploads fine, only larger
+        metrics.increment("ocr_payload_reductions_skipped_total")
+        print(f"Server busy, uploading {pdf_path} for OCR without reducing it")
+    except Exception as e:
+        print(f"Could not reduce OCR payload for {pdf_path}: {e}")
+
+    stats["payload_bytes"] = len(payload)
+    stats["bytes_saved"] = len(original) - len(payload)
+    metrics.increment("ocr_payload_bytes_total", len(original), kind="original")
+    metrics.increment("ocr_payload_bytes_total", len(payload), kind="uploaded")
+    if stats["total_pages"]:
+        metrics.increment("ocr_payload_pages_skipped_total", stats["total_pages"] - stats["pages"])
+    print(f"OCR payload for {pdf_path}: {len(original)} -> {len(payload)} bytes "
+          f"({stats['bytes_saved']} saved), {stats['pages']}/{stats['total_pages']} pages")
+    _record_request_stats(stats)
+    return payload
+
+
+def _record_request_stats(stats):
+    metrics.add_request_details(**{
+        f"ocr_{name}": value for name, value in stats.items() if value is not None
+    })
+
+
+metrics.describe("ocr_payload_bytes_total", "Bytes of PDFs sent to OCR, before (original) and after (uploaded) reduction.")
+metrics.describe("ocr_payload_pages_skipped_total", "Pages left out of OCR uploads by page selection.")
+metrics.describe("ocr_payload_reductions_skipped_total", "OCR uploads sent unreduced because admission control rejected the reduction.")
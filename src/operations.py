@@ -0,0 +1,84 @@
+from src.invert_color import invert_document, delete_pages, parse_page_ranges, INVERT_MODES
+from src.customize_color import recolor_document, hex_to_rgb
+from src.redact import redact_document
+
+
+def _remove(doc, op):
+    delete_pages(doc, parse_page_ranges(str(op['pages'])))
+    return doc
+
+
+def _redact(doc, op):
+    redact_document(doc, op['redactions'], op.get('fill', (0, 0, 0)))
+    return doc
+
+
+def _invert(doc, op):
+    new_doc = invert_document(doc, op.get('mode', 'all'))
+    doc.close()
+    return new_doc
+
+
+def _customize(doc, op):
+    recolor_document(doc, hex_to_rgb(op.get('bg_color', '#000000')), hex_to_rgb(op.get('text_color', '#ffffff')))
+    return doc
+
+
+# Operations that work on an open document; each returns the resulting document,
+# which is a new object for operations that rebuild the document (invert)
+OPERATIONS = {
+    'remove': _remove,
+    'redact': _redact,
+    'invert': _invert,
+    'customize': _customize,
+}
+
+
+def validate_operation(op):
+    """
+    Checks an operation's parameters before it is applied or recorded.
+    :param op: Dict with an "operation" key plus the operation's parameters.
+    :raises ValueError: If the operation is unknown or its parameters are invalid.
+    """
+    if not isinstance(op, dict) or op.get('operation') not in OPERATIONS:
+        raise ValueError(f"Unsupported operation, expected one of: {', '.join(OPERATIONS)}")
+
+    name = op['operation']
+    if name == 'remove':
+        try:
+            pages = parse_page_ranges(str(op.get('pages', '')))
+        except ValueError:
+            raise ValueError("Invalid page selection")
+        # Page numbers start at 1, and reversed ranges such as "5-3" select nothing
+        if not pages or min(pages) < 0:
+            raise ValueError("Invalid page selection")
+    elif name == 'redact':
+        redactions = op.get('redactions')
+        if not isinstance(redactions, list) or not redactions:
+            raise ValueError("Missing redactions")
+        for redaction in redactions:
+            if not isinstance(redaction, dict) or not isinstance(redaction.get('page'), int) or not all(
+                isinstance(redaction.get(key), (int, float)) for key in ('x', 'y', 'width', 'height')
+            ):
+                raise ValueError("Invalid redaction")
+            if redaction['page'] < 0:
+                raise ValueError("Invalid redaction page")
+        fill = op.get('fill', (0, 0, 0))
+        if not isinstance(fill, (list, tuple)) or len(fill) != 3 or not all(
+            isinstance(c, (int, float)) and 0 <= c <= 1 for c in fill
+        ):
+            raise ValueError("Invalid redaction fill color")
+    elif name == 'invert':
+        if op.get('mode', 'all') not in INVERT_MODES:
+            raise ValueError("Invalid invert mode")
+    elif name == 'customize':
+        hex_to_rgb(op.get('bg_color', '#000000'))
+        hex_to_rgb(op.get('text_color', '#ffffff'))
+
+
+def apply_operation(doc, op):
+    """
+    Applies a validated operation to an open document.
+    :return: The resulting document (may be a different object than doc).
+    """
+    return OPERATIONS[op['operation']](doc, op)
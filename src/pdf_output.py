@@ -0,0 +1,66 @@
+import os
+
+import pymupdf
+
+from src import metrics
+
+# Options passed to Document.save for each output preset
+SAVE_PRESETS = {
+    # No extra work at save time
+    "fast": {},
+    # Drop unused objects, compress streams and pack objects into object streams
+    "balanced": {
+        "garbage": 3,
+        "deflate": True,
+        "deflate_fonts": True,
+        "use_objstms": 1,
+    },
+    # Also merge duplicate objects, clean content streams and subset fonts
+    "smallest": {
+        "garbage": 4,
+        "clean": True,
+        "deflate": True,
+        "deflate_images": True,
+        "deflate_fonts": True,
+        "use_objstms": 1,
+    },
+}
+
+DEFAULT_SAVE_PRESET = os.environ.get("PDF_SAVE_PRESET", "balanced")
+if DEFAULT_SAVE_PRESET not in SAVE_PRESETS:
+    raise ValueError(f"PDF_SAVE_PRESET must be one of: {', '.join(SAVE_PRESETS)}")
+
+
+def save_pdf(doc, output_pdf_path, preset=None, keep_document=False):
+    """
+    Saves a document using one of the output presets.
+    :param doc: A PyMuPDF Document.
+    :param output_pdf_path: Path where the PDF will be saved.
+    :param preset: One of SAVE_PRESETS; defaults to PDF_SAVE_PRESET ("balanced").
+    :param keep_document: The document stays in use after saving (e.g. an edit
+        session), so presets that rewrite it in memory work on a copy instead.
+    :raises ValueError: If the preset is unknown.
+    """
+    preset = preset or DEFAULT_SAVE_PRESET
+    if preset not in SAVE_PRESETS:
+        raise ValueError(f"Unknown preset, expected one of: {', '.join(SAVE_PRESETS)}")
+
+    if preset == "smallest":
+        # Subsetting fonts rewrites the document, which must not happen to one still being edited
+        target = pymupdf.open("pdf", doc.tobytes()) if keep_document else doc
+        try:
+            target.subset_fonts()
+        except Exception as e:
+            print(f"Could not subset fonts: {e}")
+        try:
+            target.save(output_pdf_path, **SAVE_PRESETS[preset])
+        finally:
+            if target is not doc:
+                target.close()
+    else:
+        doc.save(output_pdf_path, **SAVE_PRESETS[preset])
+
+    metrics.increment("pdf_output_bytes_total", os.path.getsize(output_pdf_path), preset=preset)
+
+
+metrics.describe("pdf_output_bytes_total", "Bytes written to output PDFs by save preset.")
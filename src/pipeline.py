@@ -0,0 +1,155 @@
+import pymupdf
+
+from src import metrics
+from src.profiling import profiled
+from src.pdf_output import save_pdf, SAVE_PRESETS
+from src.invert_color import parse_page_ranges
+from src.operations import validate_operation, apply_operation
+
+
+def _validate(op):
+    if isinstance(op, dict) and op.get('operation') == 'optimize':
+        if op.get('preset', 'balanced') not in SAVE_PRESETS:
+            raise ValueError(f"Unknown preset, expected one of: {', '.join(SAVE_PRESETS)}")
+        return
+    validate_operation(op)
+
+
+def _removed_indexes(op):
+    indexes = set(parse_page_ranges(str(op['pages'])))
+    # Renumbering relies on every index being a real page position
+    if any(index < 0 for index in indexes):
+        raise ValueError("Invalid page selection")
+    return indexes
+
+
+def _remove_op(indexes):
+    return {'operation': 'remove', 'pages': ','.join(str(i + 1) for i in sorted(indexes))}
+
+
+def _to_earlier_numbering(indexes, earlier_removed):
+    """
+    Maps page indexes counted after a removal back to indexes counted before it.
+    """
+    mapped = []
+    original = 0
+    position = 0
+    for index in sorted(indexes):
+        while True:
+            if original not in earlier_removed:
+                if position == index:
+                    break
+                position += 1
+            original += 1
+        mapped.append(original)
+    return set(mapped)
+
+
+def _shift_redactions(op, removed):
+    """
+    Renumbers a redact step's pages as if the removal had happened before it.
+    """
+    redactions = []
+    for redaction in op['redactions']:
+        if redaction['page'] in removed:
+            continue
+        shifted = dict(redaction)
+        shifted['page'] -= sum(1 for page in removed if page < redaction['page'])
+        redactions.append(shifted)
+    return dict(op, redactions=redactions)
+
+
+def plan_pipeline(operations):
+    """
+    Validates a list of operations and rewrites it into an equivalent, cheaper plan.
+
+    - Page removals move ahead of invert, customize and redact steps (renumbering
+      redactions), and consecutive removals are merged, so removed pages are never
+      rendered.
+    - Redactions that follow a full inversion move ahead of it with an inverted fill
+      color, so content is removed from the vector page before rasterization.
+    - Two consecutive full inversions cancel out.
+    - "optimize" selects the save preset and is not a processing step.
+
+    :param operations: List of operation dicts, e.g. {"operation": "remove", "pages": "3-5"}.
+    :return: Tuple of (list of steps, save preset or None).
+    :raises ValueError: If an operation is unknown or invalid.
+    """
+    preset = None
+    steps = []
+    for op in operations:
+        _validate(op)
+        name = op['operation']
+
+        if name == 'optimize':
+            preset = op.get('preset', 'balanced')
+            continue
+
+        if name == 'remove':
+            removed = _removed_indexes(op)
+            position = len(steps)
+            while position > 0:
+                previous = steps[position - 1]
+                if previous['operation'] in ('invert', 'customize'):
+                    position -= 1
+                elif previous['operation'] == 'redact':
+                    steps[position - 1] = _shift_redactions(previous, removed)
+                    position -= 1
+                elif previous['operation'] == 'remove':
+                    earlier = _removed_indexes(previous)
+                    removed = earlier | _to_earlier_numbering(removed, earlier)
+                    del steps[position - 1]
+                    position -= 1
+                else:
+                    break
+            if removed:
+                steps.insert(position, _remove_op(removed))
+            continue
+
+        if name == 'redact' and steps and steps[-1]['operation'] == 'invert' \
+                and steps[-1].get('mode', 'all') == 'all':
+            fill = op.get('fill', (0, 0, 0))
+            steps.insert(len(steps) - 1, dict(op, fill=[1 - c for c in fill]))
+            continue
+
+        if name == 'invert' and op.get('mode', 'all') == 'all' and steps \
+                and steps[-1]['operation'] == 'invert' and steps[-1].get('mode', 'all') == 'all':
+            steps.pop()
+            continue
+
+        steps.append(dict(op))
+
+    # Redactions that were renumbered away entirely are no-ops
+    steps = [step for step in steps if step['operation'] != 'redact' or step['redactions']]
+    return steps, preset
+
+
+@profiled("pipeline")
+def run_pipeline(input_pdf_path, output_pdf_path, operations, extra_pdf_paths=()):
+    """
+    Runs a list of operations on a PDF with a single open and a single save.
+    :param input_pdf_path: Path to the input PDF.
+    :param output_pdf_path: Path where the result will be saved.
+    :param operations: List of operation dicts, see plan_pipeline.
+    :param extra_pdf_paths: PDFs appended to the input (in order) before the first step.
+    :return: The executed plan (list of steps).
+    """
+    steps, preset = plan_pipeline(operations)
+
+    with metrics.stage("open", "pipeline"):
+        doc = pymupdf.open(input_pdf_path)
+        for path in extra_pdf_paths:
+            with pymupdf.open(path) as extra:
+                doc.insert_pdf(extra)
+
+    try:
+        for step in steps:
+            with metrics.stage(step['operation'], "pipeline"):
+                doc = apply_operation(doc, step)
+
+        with metrics.stage("save", "pipeline"):
+            save_pdf(doc, output_pdf_path, preset)
+    finally:
+        doc.close()
+
+    return steps
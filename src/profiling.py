@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import random
+import pstats
+import hashlib
+import inspect
+import cProfile
+import threading
+import contextvars
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+
+import pymupdf
+
+from src import metrics
+
+# Directory where captured profiles are stored
+PROFILE_FOLDER = os.environ.get("PROFILE_FOLDER", "/tmp/profiles")
+# Fraction of requests (0.0 - 1.0) that are profiled without being asked to
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# Requests sending this value in the X-Profile header are always profiled.
+# Header-triggered profiling is disabled while this is unset.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+
+PROFILE_HEADER = "X-Profile"
+
+# Whether the current request was selected for profiling. A context variable rather
+# than a thread local, so concurrent async requests served by one thread are separate.
+_enabled = contextvars.ContextVar("profile_request", default=False)
+# tracemalloc is process-wide, so only one call per process is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def begin_request(header_value=None):
+    """
+    Decides whether the current request should be profiled.
+    :param header_value: Value of the X-Profile request header, if any.
+    """
+    requested = bool(PROFILE_TOKEN) and header_value == PROFILE_TOKEN
+    sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    _enabled.set(requested or sampled)
+
+
+def end_request():
+    _enabled.set(False)
+
+
+def is_enabled():
+    return _enabled.get()
+
+
+def file_sha256(path):
+    """
+    Computes the SHA-256 of a file without reading it into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _page_count(path):
+    try:
+        with pymupdf.open(path) as doc:
+            return doc.page_count
+    except Exception:
+        return None
+
+
+@contextmanager
+def _profile_call(operation, input_pdf_path):
+    # Profiles the enclosed call if the request was selected and no other call is being profiled
+    if not is_enabled():
+        yield
+        return
+    # Only profile the outermost call if profiled functions are nested
+    _enabled.set(False)
+
+    if not _profile_lock.acquire(blocking=False):
+        metrics.increment("profiles_skipped_total", operation=operation)
+        try:
+            yield
+        finally:
+            _enabled.set(True)
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+        _enabled.set(True)
+        try:
+            save_profile(operation, input_pdf_path, profiler, elapsed, peak)
+        except Exception as e:
+            print(f"Error saving profile for {input_pdf_path}: {e}")
+
+
+def profiled(operation):
+    """
+    Decorator that captures a cProfile profile and the tracemalloc peak of a call
+    when the current request was selected for profiling.
+
+    The decorated function's first argument must be the input PDF path, which is
+    used to tag the stored profile with the file's hash and page count.
+    Only one call per process is profiled at a time: a call that starts while another
+    is being profiled runs unprofiled rather than waiting, so profiling never delays
+    requests. The memory peak still includes allocations of unprofiled requests
+    running at the same time.
+    Coroutine functions are profiled from start to finish; since the profiler covers
+    the whole thread, the profile also includes other coroutines the event loop ran
+    while the call was waiting.
+    :param operation: Name of the operation, e.g. "invert" or "customize".
+    """
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def decorated_coroutine(input_pdf_path, *args, **kwargs):
+                with _profile_call(operation, input_pdf_path):
+                    return await f(input_pdf_path, *args, **kwargs)
+            return decorated_coroutine
+
+        @wraps(f)
+        def decorated_function(input_pdf_path, *args, **kwargs):
+            with _profile_call(operation, input_pdf_path):
+                return f(input_pdf_path, *args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def save_profile(operation, input_pdf_path, profiler, elapsed, peak_bytes):
+    """
+    Stores a profile as <operation>_<hash>_<timestamp>_<random>.prof with a .json sidecar.
+    :return: Path of the .prof file.
+    """
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    sha256 = file_sha256(input_pdf_path)
+    # One timestamp for both parts; the random suffix keeps profiles of the same
+    # file taken within the same millisecond apart
+    now = time.time()
+    timestamp = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}"
+    base = f"{operation}_{sha256[:16]}_{timestamp}_{os.urandom(3).hex()}"
+    prof_path = os.path.join(PROFILE_FOLDER, f"{base}.prof")
+
+    pstats.Stats(profiler).dump_stats(prof_path)
+    with open(os.path.join(PROFILE_FOLDER, f"{base}.json"), "w") as f:
+        json.dump({
+            "operation": operation,
+            "input_sha256": sha256,
+            "input_bytes": os.path.getsize(input_pdf_path),
+            "page_count": _page_count(input_pdf_path),
+            "duration_seconds": round(elapsed, 4),
+            "tracemalloc_peak_bytes": peak_bytes,
+            "profile": os.path.basename(prof_path),
+        }, f, indent=2)
+
+    print(f"Saved {operation} profile to {prof_path}")
+    return prof_path
+
+
+metrics.describe("profiles_skipped_total", "Sampled calls run unprofiled because another profile was in progress.")
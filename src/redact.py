@@ -0,0 +1,26 @@
+from src import metrics
+
+
+def redact_document(doc, redactions, fill=(0, 0, 0)):
+    """
+    Blacks out rectangular areas and removes the content underneath them.
+    :param doc: A PyMuPDF Document, modified in place.
+    :param redactions: List of dicts with "page" (0-based), "x", "y", "width" and "height" in PDF points.
+    :param fill: Color of the redaction boxes as an (r, g, b) tuple of floats in [0, 1].
+    """
+    # Group by page so each page's redactions are applied in one pass
+    pages = {}
+    for redaction in redactions:
+        pages.setdefault(redaction['page'], []).append(redaction)
+
+    with metrics.stage("redact", "redact"):
+        for page_num, page_redactions in pages.items():
+            if not 0 <= page_num < doc.page_count:
+                continue
+            page = doc[page_num]
+            for redaction in page_redactions:
+                x0, y0 = redaction['x'], redaction['y']
+                x1, y1 = x0 + redaction['width'], y0 + redaction['height']
+                page.add_redact_annot((x0, y0, x1, y1), fill=tuple(fill))
+            page.apply_redactions()
+            metrics.increment("pdf_pages_processed_total", operation="redact")
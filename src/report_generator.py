@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import pymupdf
+from jinja2 import Environment, FileSystemLoader
+
+REPORT_BACKENDS = ("story", "pdfkit")
+# Build state of an output directory: fingerprint of the inputs of every report
+MANIFEST_NAME = ".reports.json"
+MM = 72 / 25.4
+
+# One report to build: the output file name (relative to the output directory),
+# the template context, and optionally a template other than the batch default
+ReportJob = namedtuple("ReportJob", ["output_name", "context", "template"], defaults=(None,))
+
+# Per worker process: settings of the batch and compiled templates by path
+_settings = {}
+_templates = {}
+
+
+def _init_worker(settings):
+    _settings.clear()
+    _settings.update(settings)
+    _templates.clear()
+
+
+def _get_template(path):
+    # Each template variant is loaded and compiled once per worker
+    template = _templates.get(path)
+    if template is None:
+        directory, name = os.path.split(os.path.abspath(path))
+        template = _templates[path] = Environment(loader=FileSystemLoader(directory)).get_template(name)
+    return template
+
+
+def write_story_pdf(html, output_pdf_path, paper="a4", margins_mm=(20, 22, 20, 22), user_css=None):
+    """
+    Lays out HTML with PyMuPDF's Story engine and writes it as a PDF, in process.
+    MuPDF supports a subset of CSS; @page is not read, so page size and margins are passed here.
+    :param html: The HTML document.
+    :param output_pdf_path: Path where the PDF will be saved.
+    :param paper: Paper size name understood by pymupdf.paper_rect, e.g. "a4" or "letter".
+    :param margins_mm: Page margins (left, top, right, bottom) in millimetres.
+    :param user_css: Extra CSS applied on top of the document's own styles.
+    """
+    page_rect = pymupdf.paper_rect(paper)
+    left, top, right, bottom = (margin * MM for margin in margins_mm)
+    where = page_rect + (left, top, -right, -bottom)
+
+    story = pymupdf.Story(html=html, user_css=user_css)
+    writer = pymupdf.DocumentWriter(output_pdf_path, "compress")
+    more = True
+    while more:
+        device = writer.begin_page(page_rect)
+        more, _ = story.place(where)
+        story.draw(device)
+        writer.end_page()
+    writer.close()
+
+
+def write_pdfkit_pdf(html, output_pdf_path):
+    """
+    Converts HTML with wkhtmltopdf (one subprocess per document) for templates that
+    need CSS the Story engine does not support.
+    """
+    import pdfkit
+    pdfkit.from_string(html, output_pdf_path)
+
+
+def _build_report(job):
+    """
+    Renders and writes one report in a worker.
+    :return: Tuple of (output name, render seconds, write seconds, error or None).
+    """
+    output_path = os.path.join(_settings["output_dir"], job.output_name)
+    tmp_path = output_path + ".tmp"
+    try:
+        start = time.perf_counter()
+        html = _get_template(job.template or _settings["template_path"]).render(**job.context)
+        rendered = time.perf_counter()
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        if _settings["backend"] == "pdfkit":
+            write_pdfkit_pdf(html, tmp_path)
+        else:
+            write_story_pdf(html, tmp_path, _settings["paper"], _settings["margins_mm"], _settings["story_css"])
+        # Interrupted runs never leave a partial file under the final name
+        os.replace(tmp_path, output_path)
+        return job.output_name, rendered - start, time.perf_counter() - rendered, None
+    except Exception as e:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return job.output_name, 0.0, 0.0, f"{type(e).__name__}: {e}"
+
+
+def _file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _fingerprint(job, template_hashes, settings):
+    payload = json.dumps({
+        "template": template_hashes[job.template or settings["template_path"]],
+        "context": job.context,
+        "backend": settings["backend"],
+        "paper": settings["paper"],
+        "margins_mm": list(settings["margins_mm"]),
+        "story_css": settings["story_css"],
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def build_reports(template_path, jobs, output_dir, workers=None, backend="story", paper="a4",
+                  margins_mm=(20, 22, 20, 22), story_css=None, force=False):
+    """
+    Builds a batch of PDF reports from Jinja templates in parallel worker processes.
+
+    Only reports whose inputs changed since the last run are rebuilt: a manifest in
+    the output directory records a fingerprint of each report's template source,
+    context and layout settings. Templates included from other files are not part
+    of the fingerprint; use force after editing them.
+    :param template_path: Default Jinja template for the jobs.
+    :param jobs: Iterable of ReportJob.
+    :param output_dir: Directory the PDFs are written to.
+    :param workers: Worker processes; defaults to the number of CPUs. 1 builds in process.
+    :param backend: "story" (PyMuPDF, in process) or "pdfkit" (wkhtmltopdf).
+    :param paper: Paper size for the story backend.
+    :param margins_mm: Page margins (left, top, right, bottom) for the story backend.
+    :param story_css: Extra CSS for the story backend, e.g. to stand in for unsupported properties.
+    :param force: Rebuild every report regardless of the manifest.
+    :return: Summary dict with counts, timings and errors (see print_summary).
+    """
+    if backend not in REPORT_BACKENDS:
+        raise ValueError(f"Unknown backend, expected one of: {', '.join(REPORT_BACKENDS)}")
+    start = time.perf_counter()
+    jobs = list(jobs)
+    os.makedirs(output_dir, exist_ok=True)
+    settings = {
+        "template_path": template_path,
+        "output_dir": output_dir,
+        "backend": backend,
+        "paper": paper,
+        "margins_mm": tuple(margins_mm),
+        "story_css": story_css,
+    }
+
+    template_hashes = {}
+    for path in {job.template or template_path for job in jobs}:
+        template_hashes[path] = _file_sha256(path)
+
+    manifest = {} if force else _load_manifest(output_dir)
+    fingerprints = {job.output_name: _fingerprint(job, template_hashes, settings) for job in jobs}
+    pending = [
+        job for job in jobs
+        if manifest.get(job.output_name) != fingerprints[job.output_name]
+        or not os.path.exists(os.path.join(output_dir, job.output_name))
+    ]
+
+    workers = min(workers or os.cpu_count() or 1, max(len(pending), 1))
+    if workers <= 1:
+        _init_worker(settings)
+        results = [_build_report(job) for job in pending]
+    else:
+        # Hand out jobs in batches so thousands of small reports do not cost a round trip each
+        chunksize = max(1, len(pending) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(settings,)) as pool:
+            results = list(pool.map(_build_report, pending, chunksize=chunksize))
+
+    errors = {}
+    render_times = []
+    write_times = []
+    for output_name, render_seconds, write_seconds, error in results:
+        if error:
+            errors[output_name] = error
+            manifest.pop(output_name, None)
+            continue
+        manifest[output_name] = fingerprints[output_name]
+        render_times.append(render_seconds)
+        write_times.append(write_seconds)
+    _save_manifest(output_dir, manifest)
+
+    build_times = sorted(r + w for r, w in zip(render_times, write_times))
+    wall_seconds = time.perf_counter() - start
+    return {
+        "total": len(jobs),
+        "built": len(build_times),
+        "skipped": len(jobs) - len(pending),
+        "failed": len(errors),
+        "workers": workers,
+        "backend": backend,
+        "wall_seconds": wall_seconds,
+        "render_seconds": sum(render_times),
+        "write_seconds": sum(write_times),
+        "median_report_seconds": build_times[len(build_times) // 2] if build_times else 0.0,
+        "max_report_seconds": build_times[-1] if build_times else 0.0,
+        "reports_per_second": len(build_times) / wall_seconds if wall_seconds else 0.0,
+        "errors": errors,
+    }
+
+
+def print_summary(summary):
+    """
+    Prints the timing summary of a build_reports run.
+    """
+    print(f"Reports: {summary['total']} total, {summary['built']} built, "
+          f"{summary['skipped']} unchanged, {summary['failed']} failed "
+          f"({summary['backend']}, {summary['workers']} workers)")
+    print(f"Time: {summary['wall_seconds']:.2f}s wall, {summary['reports_per_second']:.1f} reports/s; "
+          f"per report median {summary['median_report_seconds'] * 1000:.1f}ms, "
+          f"max {summary['max_report_seconds'] * 1000:.1f}ms; "
+          f"template rendering {summary['render_seconds']:.2f}s, PDF layout {summary['write_seconds']:.2f}s (summed over reports)")
+    for output_name, error in summary["errors"].items():
+        print(f"Failed {output_name}: {error}")
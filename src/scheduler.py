@@ -0,0 +1,286 @@
+import os
+import json
+import math
+import time
+import uuid
+import fcntl
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pymupdf
+
+from src import metrics
+from src.invert_color import MAX_RENDER_BYTES, RENDER_MEMORY_FACTOR
+
+# Budgets are shared by all worker processes that use the same ADMISSION_STATE_DIR
+ADMISSION_MEMORY_BYTES = int(os.environ.get("ADMISSION_MEMORY_MB", "1024")) * 1024 * 1024
+ADMISSION_MAX_JOBS = int(os.environ.get("ADMISSION_MAX_JOBS", str(os.cpu_count() or 1)))
+# How long a job may wait in the queue before it is rejected
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+# Holds the ledger of running and waiting jobs shared by the worker processes
+ADMISSION_STATE_DIR = os.environ.get("ADMISSION_STATE_DIR", "/tmp/admission")
+# How often a waiting job checks whether jobs of other processes have finished
+ADMISSION_POLL_INTERVAL = float(os.environ.get("ADMISSION_POLL_INTERVAL", "0.05"))
+
+# Throughput used to turn job sizes into estimated seconds, measured on one core:
+# inverting renders ~35M pixels/s, structural rewrites and saves ~150MB/s
+RENDER_PIXELS_PER_SECOND = 30_000_000
+DOCUMENT_BYTES_PER_SECOND = 100_000_000
+# Reducing a PDF for OCR (image downsampling and a compact save) runs at ~40MB/s
+OCR_REDUCE_BYTES_PER_SECOND = 30_000_000
+
+# memory_bytes: estimated peak memory, work: estimated CPU seconds, used to order the queue
+JobCost = namedtuple("JobCost", ["memory_bytes", "work"])
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job cannot be admitted; retry_after is in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_render_cost(pdf_path, zoom=2):
+    """
+    Estimates the cost of rasterizing every page of a PDF (e.g. for inversion).
+    :param pdf_path: Path to the input PDF.
+    :param zoom: Render zoom factor.
+    :return: A JobCost.
+    """
+    file_size = os.path.getsize(pdf_path)
+    try:
+        with pymupdf.open(pdf_path) as doc:
+            return estimate_open_document_render_cost(doc, file_size, zoom)
+    except Exception:
+        # Unreadable files fail fast in the processing step itself
+        return estimate_document_cost(file_size)
+
+
+def estimate_open_document_render_cost(doc, size_bytes, zoom=2):
+    """
+    Same as estimate_render_cost, for a document that is already open.
+    :param doc: A PyMuPDF Document.
+    :param size_bytes: Size of the document's file.
+    :param zoom: Render zoom factor.
+    :return: A JobCost.
+    """
+    peak_page_bytes = 0
+    total_pixels = 0
+    for page in doc:
+        rect = page.rect
+        pixels = rect.width * zoom * rect.height * zoom
+        total_pixels += pixels
+        # Pages above the budget are tiled, so they never need more than MAX_RENDER_BYTES
+        peak_page_bytes = max(peak_page_bytes, min(pixels * 3 * RENDER_MEMORY_FACTOR, MAX_RENDER_BYTES))
+    # Pages are rendered one at a time; source and output documents stay open throughout
+    seconds = total_pixels / RENDER_PIXELS_PER_SECOND + size_bytes / DOCUMENT_BYTES_PER_SECOND
+    return JobCost(int(peak_page_bytes + size_bytes * 3), seconds)
+
+
+def estimate_document_cost(size_bytes):
+    """
+    Estimates the cost of a structural operation (remove, merge, redact, recolor).
+    :param size_bytes: Total size of the input files.
+    :return: A JobCost.
+    """
+    size_bytes = size_bytes or 0
+    return JobCost(size_bytes * 3, size_bytes / DOCUMENT_BYTES_PER_SECOND)
+
+
+def estimate_ocr_reduce_cost(size_bytes):
+    """
+    Estimates the cost of reducing a PDF before it is uploaded for OCR.
+    :param size_bytes: Size of the PDF.
+    :return: A JobCost.
+    """
+    size_bytes = size_bytes or 0
+    # The original bytes, the open document and the reduced copy are in memory together
+    return JobCost(size_bytes * 4, size_bytes / OCR_REDUCE_BYTES_PER_SECOND)
+
+
+class AdmissionScheduler:
+    """
+    Admits jobs against a memory budget and a maximum number of concurrent jobs.
+    Waiting jobs are admitted cheapest first, so small files are not stuck behind huge ones.
+
+    Running and waiting jobs, and memory held outside of jobs (see hold), are recorded
+    in a ledger file guarded by a file lock, so every worker process using the same
+    state directory shares one budget and one queue. Entries of worker processes
+    that died are dropped.
+    """
+
+    def __init__(self, memory_budget=ADMISSION_MEMORY_BYTES, max_jobs=ADMISSION_MAX_JOBS,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, max_queue=ADMISSION_MAX_QUEUE,
+                 state_dir=ADMISSION_STATE_DIR, poll_interval=ADMISSION_POLL_INTERVAL):
+        self.memory_budget = memory_budget
+        self.max_jobs = max_jobs
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+        self.ledger_path = os.path.join(state_dir, "ledger.json")
+        self.lock_path = os.path.join(state_dir, "ledger.lock")
+        os.makedirs(state_dir, exist_ok=True)
+
+        # Wakes waiters of this process as soon as a local job finishes;
+        # jobs finishing in other processes are noticed by polling
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def _ledger(self):
+        """
+        Gives exclusive access to the ledger across processes; changes are saved on exit.
+        """
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.ledger_path) as f:
+                    saved = f.read()
+                ledger = json.loads(saved)
+            except (OSError, ValueError):
+                saved = None
+                ledger = {"running": {}, "waiting": {}, "sequence": 0}
+            ledger.setdefault("held", {})
+            self._drop_dead_processes(ledger)
+
+            yield ledger
+
+            # Waiters poll the ledger; most polls change nothing and skip the write
+            updated = json.dumps(ledger)
+            if updated != saved:
+                tmp_path = self.ledger_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(updated)
+                os.replace(tmp_path, self.ledger_path)
+            self._update_gauges(ledger)
+
+    @staticmethod
+    def _drop_dead_processes(ledger):
+        alive = {}
+        for entries in (ledger["running"], ledger["waiting"], ledger["held"]):
+            for job_id, entry in list(entries.items()):
+                pid = entry["pid"]
+                if pid not in alive:
+                    try:
+                        os.kill(pid, 0)
+                        alive[pid] = True
+                    except ProcessLookupError:
+                        alive[pid] = False
+                    except PermissionError:
+                        alive[pid] = True
+                if not alive[pid]:
+                    del entries[job_id]
+
+    def _fits(self, ledger, memory):
+        running = ledger["running"]
+        if len(running) >= self.max_jobs:
+            return False
+        # A job larger than the whole budget may still run on its own
+        return not running or self._memory_in_use(ledger) + memory <= self.memory_budget
+
+    @staticmethod
+    def _memory_in_use(ledger):
+        return sum(entry["memory"] for entry in ledger["running"].values()) + \
+            sum(entry["memory"] for entry in ledger["held"].values())
+
+    @staticmethod
+    def _next_in_line(ledger):
+        waiting = ledger["waiting"]
+        return min(waiting, key=lambda job_id: (waiting[job_id]["work"], waiting[job_id]["sequence"]))
+
+    def _retry_after(self):
+        return max(1, math.ceil(self.queue_timeout))
+
+    def _update_gauges(self, ledger):
+        metrics.set_gauge("admission_queue_depth", len(ledger["waiting"]))
+        metrics.set_gauge("admission_running_jobs", len(ledger["running"]))
+        metrics.set_gauge("admission_memory_in_use_bytes", self._memory_in_use(ledger))
+        metrics.set_gauge("admission_memory_held_bytes", sum(entry["memory"] for entry in ledger["held"].values()))
+
+    def hold(self, key, memory_bytes):
+        """
+        Records memory this process keeps in use outside of a job, such as an open
+        pooled document, so admitted jobs leave room for it. Replaces an earlier
+        hold with the same key.
+        :param key: Name of the holding, unique within this process.
+        :param memory_bytes: Estimated memory held.
+        """
+        with self._ledger() as ledger:
+            ledger["held"][f"{os.getpid()}:{key}"] = {"pid": os.getpid(), "memory": memory_bytes}
+
+    def release(self, key):
+        """
+        Ends a hold recorded with hold().
+        """
+        with self._ledger() as ledger:
+            ledger["held"].pop(f"{os.getpid()}:{key}", None)
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost, operation=""):
+        """
+        Waits until the job fits within the budget and holds its share while the block runs.
+        :param cost: JobCost of the job.
+        :param operation: Operation name, used for metrics.
+        :raises AdmissionRejected: If the queue is full or the job waited too long.
+        """
+        memory = min(cost.memory_bytes, self.memory_budget)
+        job_id = uuid.uuid4().hex
+        with self._ledger() as ledger:
+            if len(ledger["waiting"]) >= self.max_queue:
+                metrics.increment("admission_rejected_total", operation=operation, reason="queue_full")
+                raise AdmissionRejected("Server is busy, please try again shortly", self._retry_after())
+            ledger["sequence"] += 1
+            ledger["waiting"][job_id] = {"pid": os.getpid(), "work": cost.work, "memory": memory,
+                                         "sequence": ledger["sequence"]}
+
+        deadline = time.monotonic() + self.queue_timeout
+        wait_start = time.perf_counter()
+        admitted = False
+        try:
+            while True:
+                with self._ledger() as ledger:
+                    if job_id not in ledger["waiting"]:
+                        # Only happens if the ledger was lost; queue again at the back
+                        ledger["sequence"] += 1
+                        ledger["waiting"][job_id] = {"pid": os.getpid(), "work": cost.work, "memory": memory,
+                                                     "sequence": ledger["sequence"]}
+                    if self._next_in_line(ledger) == job_id and self._fits(ledger, memory):
+                        del ledger["waiting"][job_id]
+                        ledger["running"][job_id] = {"pid": os.getpid(), "memory": memory}
+                        admitted = True
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.increment("admission_rejected_total", operation=operation, reason="timeout")
+                    raise AdmissionRejected("Server is busy, please try again shortly", self._retry_after())
+                with self._cond:
+                    self._cond.wait(min(remaining, self.poll_interval))
+        finally:
+            if not admitted:
+                with self._ledger() as ledger:
+                    ledger["waiting"].pop(job_id, None)
+
+        # The next job in line may fit as well
+        with self._cond:
+            self._cond.notify_all()
+        metrics.record_stage("queue", time.perf_counter() - wait_start, operation)
+        try:
+            yield
+        finally:
+            with self._ledger() as ledger:
+                ledger["running"].pop(job_id, None)
+            with self._cond:
+                self._cond.notify_all()
+
+
+scheduler = AdmissionScheduler()
+
+metrics.describe("admission_queue_depth", "Jobs waiting for admission.", merge="latest")
+metrics.describe("admission_running_jobs", "Jobs currently admitted.", merge="latest")
+metrics.describe("admission_memory_in_use_bytes", "Estimated memory held by admitted jobs and pooled documents.", merge="latest")
+metrics.describe("admission_memory_held_bytes", "Estimated memory of pooled documents counted against the budget.", merge="latest")
+metrics.describe("admission_rejected_total", "Jobs rejected by admission control.")
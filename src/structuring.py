@@ -0,0 +1,111 @@
+import os
+import re
+
+# Markdown characters sent to the model per structuring request (~4 characters per token)
+STRUCTURE_CHUNK_CHARS = int(os.environ.get("STRUCTURE_CHUNK_CHARS", "20000"))
+# Chunks structured at the same time for one document
+STRUCTURE_CONCURRENCY = int(os.environ.get("STRUCTURE_CONCURRENCY", "4"))
+
+
+def _split_long_text(text, max_chars):
+    """
+    Splits text longer than max_chars at paragraph breaks, then at line breaks,
+    and only mid-line as a last resort.
+    """
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind("\n\n", 0, max_chars)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def split_markdown(page_markdowns, max_chars=None):
+    """
+    Groups page markdown into chunks for structuring, in document order.
+    Whole pages are packed together up to max_chars; longer pages are split.
+    :param page_markdowns: List of markdown strings, one per page.
+    :param max_chars: Chunk size limit; defaults to STRUCTURE_CHUNK_CHARS.
+    :return: List of markdown chunks.
+    """
+    max_chars = max_chars or STRUCTURE_CHUNK_CHARS
+    chunks = []
+    current = []
+    size = 0
+    for markdown in page_markdowns:
+        for piece in _split_long_text(markdown, max_chars):
+            if current and size + len(piece) + 2 > max_chars:
+                chunks.append("\n\n".join(current))
+                current = []
+                size = 0
+            current.append(piece)
+            size += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks or [""]
+
+
+def is_empty(value):
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, (list, dict)):
+        return not value
+    return False
+
+
+def _normalize_key(key):
+    return re.sub(r"[\s_\-]+", " ", str(key)).strip().casefold()
+
+
+def merge_values(current, new):
+    """
+    Merges two values found for the same key in different chunks:
+    empty values are replaced, lists are concatenated without duplicates, objects
+    are merged key by key, and for conflicting scalars the earlier chunk wins.
+    """
+    if is_empty(current):
+        return new
+    if is_empty(new):
+        return current
+    if isinstance(current, list) and isinstance(new, list):
+        return current + [item for item in new if item not in current]
+    if isinstance(current, dict) and isinstance(new, dict):
+        return merge_partials([current, new])
+    return current
+
+
+def merge_partials(partials, fields_to_extract=None):
+    """
+    Merges partial JSON results from chunks, given in document order.
+    :param partials: List of dicts returned for each chunk.
+    :param fields_to_extract: Requested field names; keys the model returned with
+        different case or separators are mapped onto them, and missing ones are
+        set to an empty string.
+    :return: The merged dict.
+    """
+    canonical = {_normalize_key(field): field for field in fields_to_extract or []}
+    merged = {}
+    for partial in partials:
+        if not isinstance(partial, dict):
+            continue
+        for key, value in partial.items():
+            key = canonical.get(_normalize_key(key), key)
+            merged[key] = merge_values(merged.get(key), value)
+    for field in fields_to_extract or []:
+        merged.setdefault(field, "")
+    return merged
+
+
+def missing_fields(result, fields_to_extract):
+    """
+    :return: Requested fields that are still empty in a (merged) result.
+    """
+    return [field for field in fields_to_extract if is_empty(result.get(field))]
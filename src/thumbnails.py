@@ -0,0 +1,106 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pymupdf
+
+from src import metrics
+
+# Requested widths are rounded up to one of these so cached renders get reused
+THUMBNAIL_WIDTHS = (100, 200, 400, 800, 1200, 1600, 2000)
+# Total size of rendered PNGs kept in memory per worker
+THUMBNAIL_CACHE_BYTES = int(os.environ.get("THUMBNAIL_CACHE_MB", "64")) * 1024 * 1024
+
+
+def snap_width(width):
+    """
+    Rounds a requested width up to the nearest supported thumbnail width.
+    """
+    for candidate in THUMBNAIL_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+
+class ThumbnailCache:
+    """
+    LRU cache of rendered page PNGs, bounded by total size in bytes.
+    """
+
+    def __init__(self, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_cache = ThumbnailCache()
+
+
+def get_page_sizes(pdf_path, start=0, end=None):
+    """
+    Returns the size of a range of pages without rendering them.
+    :param pdf_path: Path to the PDF.
+    :param start: First page (0-based, inclusive).
+    :param end: Last page (0-based, inclusive); defaults to the last page.
+    :return: Tuple of (page count, list of {"page", "width", "height"} dicts).
+    """
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+        last = page_count - 1 if end is None else min(end, page_count - 1)
+        pages = []
+        for page_num in range(max(start, 0), last + 1):
+            rect = doc[page_num].rect
+            pages.append({"page": page_num, "width": rect.width, "height": rect.height})
+    return page_count, pages
+
+
+def render_thumbnail(pdf_path, page_num, width):
+    """
+    Renders a single page as a PNG at (roughly) the requested width, using the cache.
+    :param pdf_path: Path to the PDF.
+    :param page_num: Page to render (0-based).
+    :param width: Requested width in pixels; rounded up to a THUMBNAIL_WIDTHS bucket.
+    :return: PNG bytes.
+    :raises IndexError: If the page does not exist.
+    """
+    width = snap_width(width)
+    # The modification time invalidates entries when a file is re-uploaded under the same name
+    key = (os.path.abspath(pdf_path), os.stat(pdf_path).st_mtime_ns, page_num, width)
+
+    data = _cache.get(key)
+    if data is not None:
+        metrics.increment("cache_hits_total", cache="thumbnail")
+        return data
+    metrics.increment("cache_misses_total", cache="thumbnail")
+
+    with metrics.stage("render", "thumbnail"):
+        with pymupdf.open(pdf_path) as doc:
+            if not 0 <= page_num < doc.page_count:
+                raise IndexError(f"Page {page_num} out of range")
+            page = doc[page_num]
+            zoom = width / max(page.rect.width, 1)
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            data = pix.tobytes("png")
+
+    _cache.put(key, data)
+    return data
@@ -0,0 +1,92 @@
+import asyncio
+import glob
+import io
+import os
+from types import SimpleNamespace
+
+import httpx
+import pymupdf
+import pytest
+
+# The app creates its Mistral client at import time
+os.environ.setdefault("MISTRAL_API_KEY", "test")
+import asgi  # noqa: E402
+from src import extract_data, profiling  # noqa: E402
+
+
+def _pdf_bytes():
+    with pymupdf.open() as doc:
+        doc.new_page().insert_text((72, 72), "Total: 5")
+        return doc.tobytes()
+
+
+@pytest.fixture(autouse=True)
+def fake_mistral(monkeypatch):
+    async def get_ocr_response_async(pdf_file, fields_to_extract=None):
+        await asyncio.sleep(0)
+        return SimpleNamespace(pages=[object()])
+
+    async def structure_ocr_response_async(ocr_response, fields_to_extract=None):
+        return {"Total": "5"}
+
+    monkeypatch.setattr(extract_data, "get_ocr_response_async", get_ocr_response_async)
+    monkeypatch.setattr(extract_data, "structure_ocr_response_async", structure_ocr_response_async)
+    monkeypatch.setattr(extract_data, "_in_flight", None)
+
+
+async def _lifespan(app):
+    """Runs the startup half of the ASGI lifespan protocol"""
+    messages = asyncio.Queue()
+    sent = []
+    await messages.put({"type": "lifespan.startup"})
+
+    async def send(message):
+        sent.append(message)
+
+    task = asyncio.ensure_future(app({"type": "lifespan"}, messages.get, send))
+    while not sent:
+        await asyncio.sleep(0)
+    assert sent == [{"type": "lifespan.startup.complete"}]
+    await messages.put({"type": "lifespan.shutdown"})
+    await task
+
+
+async def _extract_single(headers=None):
+    await _lifespan(asgi.app)
+    transport = httpx.ASGITransport(app=asgi.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post(
+            "/extract-single", files={"file": ("doc.pdf", io.BytesIO(_pdf_bytes()), "application/pdf")},
+            headers=headers,
+        )
+
+
+def test_extraction_requires_lifespan_startup(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(_pdf_bytes())
+    data, error = asyncio.run(extract_data.extract_data_with_error_async(str(path)))
+    assert data == {} and "start_async_extraction" in error
+
+
+def test_in_flight_limit_is_created_at_startup():
+    response = asyncio.run(_extract_single())
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "data": {"Total": "5"}}
+    assert extract_data._in_flight._value == extract_data.EXTRACT_MAX_IN_FLIGHT
+
+
+def test_async_extraction_is_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    response = asyncio.run(_extract_single({profiling.PROFILE_HEADER: "secret"}))
+    assert response.status_code == 200
+    assert len(glob.glob(str(tmp_path / "extract_*.prof"))) == 1
+
+
+def test_other_routes_are_served_by_flask():
+    async def get():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/robots.txt")
+
+    assert asyncio.run(get()).status_code == 200
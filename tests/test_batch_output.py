@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+import os
+
+import pytest
+
+from src.batch_output import StreamingCsvWriter, jsonl_record, sse_event, batch_event
+
+# The app creates its Mistral client at import time
+os.environ.setdefault("MISTRAL_API_KEY", "test")
+import app as flask_app  # noqa: E402
+
+
+def _rows(text):
+    return list(csv.reader(io.StringIO(text)))
+
+
+def test_jsonl_record_reports_error():
+    record = json.loads(jsonl_record("a.pdf", {}, "OCR failed"))
+    assert record == {"filename": "a.pdf", "data": {}, "error": "OCR failed"}
+    assert "error" not in json.loads(jsonl_record("b.pdf", {"Total": "5"}))
+
+
+def test_sse_event_reports_error():
+    event = sse_event("result", batch_event(0, "a.pdf", {}, "OCR failed"))
+    payload = json.loads(event.split("data: ", 1)[1])
+    assert payload == {"index": 0, "filename": "a.pdf", "data": {}, "error": "OCR failed"}
+
+
+def test_csv_header_is_not_fixed_by_failed_first_document():
+    writer = StreamingCsvWriter()
+    assert writer.write("a.pdf", {}, "OCR failed") == ""
+    output = writer.write("b.pdf", {"Total": "5", "Date": "2024-01-01"})
+    output += writer.write("c.pdf", {"Total": "7", "Vendor": "ACME"})
+    output += writer.finish()
+    assert _rows(output) == [
+        ["filename", "Date", "Total", "_extra", "_error"],
+        ["a.pdf", "", "", "", "OCR failed"],
+        ["b.pdf", "2024-01-01", "5", "", ""],
+        ["c.pdf", "", "7", '{"Vendor": "ACME"}', ""],
+    ]
+
+
+def test_csv_with_only_failed_documents_is_written_on_finish():
+    writer = StreamingCsvWriter()
+    assert writer.write("a.pdf", {}, "OCR failed") == ""
+    assert _rows(writer.finish()) == [["filename", "_extra", "_error"], ["a.pdf", "", "OCR failed"]]
+
+
+def test_csv_with_requested_fields_writes_failures_immediately():
+    writer = StreamingCsvWriter(["Total"])
+    assert _rows(writer.write("a.pdf", {}, "OCR failed")) == [
+        ["filename", "Total", "_extra", "_error"],
+        ["a.pdf", "", "", "OCR failed"],
+    ]
+    assert writer.finish() == ""
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "csv", "sse"])
+def test_streamed_batch_reports_failed_documents(monkeypatch, output_format):
+    def fake_extract(path, fields_to_extract=None):
+        if os.path.basename(path) == "bad.pdf":
+            return {}, "OCR failed"
+        return {"Total": "5"}, None
+
+    monkeypatch.setattr(flask_app, "extract_data_with_error", fake_extract)
+    client = flask_app.app.test_client()
+    response = client.post("/extract-batch", data={
+        "format": output_format,
+        "files[]": [(io.BytesIO(b"%PDF-1.4"), "bad.pdf"), (io.BytesIO(b"%PDF-1.4"), "good.pdf")],
+    })
+    body = response.get_data(as_text=True)
+
+    if output_format == "jsonl":
+        records = [json.loads(line) for line in body.splitlines()]
+        assert records[0] == {"filename": "bad.pdf", "data": {}, "error": "OCR failed"}
+        assert records[1] == {"filename": "good.pdf", "data": {"Total": "5"}}
+    elif output_format == "csv":
+        assert _rows(body) == [
+            ["filename", "Total", "_extra", "_error"],
+            ["bad.pdf", "", "", "OCR failed"],
+            ["good.pdf", "5", "", ""],
+        ]
+    else:
+        assert '"error": "OCR failed"' in body
+        assert "event: done" in body
@@ -0,0 +1,110 @@
+import hashlib
+import io
+import os
+
+import pymupdf
+import pytest
+
+from src import chunked_upload
+
+# The app creates its Mistral client at import time
+os.environ.setdefault("MISTRAL_API_KEY", "test")
+import app as flask_app  # noqa: E402
+
+
+def _pdf_bytes(pages=3):
+    with pymupdf.open() as doc:
+        for number in range(pages):
+            doc.new_page().insert_text((72, 72), f"Page {number + 1}")
+        return doc.tobytes()
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_chunks_are_assembled_in_any_order(tmp_path):
+    content = bytes(range(256)) * 40
+    meta = chunked_upload.create_upload(str(tmp_path), "a.pdf", len(content), chunk_size=1000)
+    assert meta["chunk_count"] == 11
+
+    for index in reversed(range(meta["chunk_count"])):
+        chunk = content[index * 1000:(index + 1) * 1000]
+        chunked_upload.write_chunk(str(tmp_path), meta["upload_id"], index, io.BytesIO(chunk), sha256=_sha256(chunk))
+
+    path = chunked_upload.finalize_upload(str(tmp_path), meta["upload_id"], str(tmp_path))
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+
+def test_chunk_with_wrong_checksum_is_not_received(tmp_path):
+    meta = chunked_upload.create_upload(str(tmp_path), "a.pdf", 10, chunk_size=5)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        chunked_upload.write_chunk(str(tmp_path), meta["upload_id"], 0, io.BytesIO(b"12345"), sha256=_sha256(b"54321"))
+    assert chunked_upload.received_chunks(str(tmp_path), meta["upload_id"]) == []
+
+    # A retry with the right bytes replaces the failed attempt
+    chunked_upload.write_chunk(str(tmp_path), meta["upload_id"], 0, io.BytesIO(b"54321"), sha256=_sha256(b"54321"))
+    assert chunked_upload.received_chunks(str(tmp_path), meta["upload_id"]) == [0]
+
+
+@pytest.mark.parametrize("index, chunk, message", [
+    (2, b"12345", "out of range"),
+    (0, b"123", "should be 5 bytes"),
+    (0, b"123456", "larger than 5 bytes"),
+    (1, b"12345", "larger than 4 bytes"),
+])
+def test_chunk_index_and_size_are_checked(tmp_path, index, chunk, message):
+    meta = chunked_upload.create_upload(str(tmp_path), "a.pdf", 9, chunk_size=5)
+    with pytest.raises(ValueError, match=message):
+        chunked_upload.write_chunk(str(tmp_path), meta["upload_id"], index, io.BytesIO(chunk))
+
+
+def test_upload_with_missing_chunks_is_not_finalized(tmp_path):
+    meta = chunked_upload.create_upload(str(tmp_path), "a.pdf", 10, chunk_size=5)
+    chunked_upload.write_chunk(str(tmp_path), meta["upload_id"], 1, io.BytesIO(b"67890"))
+    with pytest.raises(ValueError, match=r"Missing chunks: \[0\]"):
+        chunked_upload.finalize_upload(str(tmp_path), meta["upload_id"], str(tmp_path))
+    assert chunked_upload.load_upload(str(tmp_path), meta["upload_id"]) is not None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(flask_app, "CHUNKED_UPLOAD_FOLDER", str(tmp_path / "chunked"))
+    os.makedirs(tmp_path / "processed")
+    monkeypatch.setitem(flask_app.app.config, "PROCESSED_FOLDER", str(tmp_path / "processed"))
+    return flask_app.app.test_client()
+
+
+def _upload(client, content):
+    response = client.post("/uploads", json={"filename": "doc.pdf", "size": len(content), "chunk_size": 1024})
+    upload_id = response.get_json()["upload_id"]
+    for index in range(response.get_json()["chunk_count"]):
+        chunk = content[index * 1024:(index + 1) * 1024]
+        response = client.put(f"/uploads/{upload_id}/chunks/{index}", data=chunk,
+                              headers={"X-Chunk-SHA256": _sha256(chunk)})
+        assert response.status_code == 200
+    return upload_id
+
+
+def test_chunk_with_wrong_checksum_is_rejected_by_route(client):
+    response = client.post("/uploads", json={"filename": "doc.pdf", "size": 5})
+    upload_id = response.get_json()["upload_id"]
+    response = client.put(f"/uploads/{upload_id}/chunks/0", data=b"12345", headers={"X-Chunk-SHA256": _sha256(b"x")})
+    assert response.status_code == 400
+    assert client.get(f"/uploads/{upload_id}").get_json()["received"] == []
+
+
+def test_completed_upload_is_inverted(client):
+    upload_id = _upload(client, _pdf_bytes())
+    response = client.post(f"/uploads/{upload_id}/complete", json={"operation": "invert"})
+    assert response.status_code == 200
+    assert response.get_json()["download_url"]
+
+
+def test_failed_invert_returns_error(client, monkeypatch):
+    monkeypatch.setattr(flask_app, "invert_pdf_colors", lambda *args, **kwargs: False)
+    upload_id = _upload(client, _pdf_bytes())
+    response = client.post(f"/uploads/{upload_id}/complete", json={"operation": "invert"})
+    assert response.status_code == 500
+    assert "download_url" not in response.get_json()
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+import pymupdf
+import pytest
+
+from src.document_pool import DocumentPool
+from src.scheduler import AdmissionScheduler, estimate_document_cost
+
+
+def _make_pdf(path, pages=3):
+    with pymupdf.open() as doc:
+        for number in range(pages):
+            doc.new_page().insert_text((72, 72), f"Page {number + 1}")
+        doc.save(path)
+    return path
+
+
+class RecordingScheduler(AdmissionScheduler):
+    def __init__(self, state_dir):
+        super().__init__(state_dir=state_dir)
+        self.admitted = []
+
+    def admit(self, cost, operation=""):
+        self.admitted.append((operation, cost))
+        return super().admit(cost, operation)
+
+    def ledger(self):
+        with open(self.ledger_path) as f:
+            return json.load(f)
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return RecordingScheduler(str(tmp_path / "admission"))
+
+
+@pytest.fixture
+def session_id(tmp_path, scheduler):
+    pool = DocumentPool(str(tmp_path / "sessions"), scheduler=scheduler)
+    session_id = pool.create(_make_pdf(str(tmp_path / "upload.pdf")), "upload.pdf")
+    with pool.checkout(session_id) as session:
+        pool.apply(session, {"operation": "remove", "pages": "1"})
+        pool.apply(session, {"operation": "invert", "mode": "all"})
+    return session_id
+
+
+def test_other_worker_replays_journal(tmp_path, scheduler, session_id):
+    other_worker = DocumentPool(str(tmp_path / "sessions"), scheduler=scheduler)
+    with other_worker.checkout(session_id) as session:
+        assert session.doc.page_count == 2
+        assert session.applied == 2
+
+
+def test_replay_is_admitted_and_priced_as_render(tmp_path, scheduler, session_id):
+    scheduler.admitted.clear()
+    other_worker = DocumentPool(str(tmp_path / "sessions"), scheduler=scheduler)
+    with other_worker.checkout(session_id):
+        pass
+    (operation, cost), = scheduler.admitted
+    assert operation == "session_replay"
+    # Rendering two letter pages at zoom 2 dominates the structural cost of the file
+    size = os.path.getsize(os.path.join(tmp_path, "sessions", session_id, "original.pdf"))
+    assert cost.work > estimate_document_cost(size).work
+
+
+def test_up_to_date_checkout_is_not_admitted(tmp_path, scheduler, session_id):
+    pool = DocumentPool(str(tmp_path / "sessions"), scheduler=scheduler)
+    with pool.checkout(session_id):
+        pass
+    scheduler.admitted.clear()
+    with pool.checkout(session_id):
+        pass
+    assert scheduler.admitted == []
+
+
+def test_open_documents_are_held_against_budget(tmp_path, scheduler, session_id):
+    pool = DocumentPool(str(tmp_path / "sessions"), scheduler=scheduler, idle_timeout=0.1)
+    with pool.checkout(session_id):
+        held = scheduler.ledger()["held"]
+        assert [key.split(":", 1)[1] for key in held] == [session_id]
+
+    # The sweeper closes the idle document without another request arriving
+    deadline = time.monotonic() + 5
+    while scheduler.ledger()["held"] and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert scheduler.ledger()["held"] == {}
+
+
+def test_delete_releases_document_and_removes_files(tmp_path, scheduler, session_id):
+    pool = DocumentPool(str(tmp_path / "sessions"), scheduler=scheduler)
+    with pool.checkout(session_id):
+        pass
+    pool.delete(session_id)
+    assert not os.path.exists(os.path.join(tmp_path, "sessions", session_id))
+    assert scheduler.ledger()["held"] == {}
+    with pytest.raises(LookupError):
+        with pool.checkout(session_id):
+            pass
@@ -0,0 +1,76 @@
+import pymupdf
+
+from src.invert_color import page_tiles, page_luminance, invert_document, RENDER_MEMORY_FACTOR
+
+
+def _page(width, height):
+    doc = pymupdf.open()
+    return doc, doc.new_page(width=width, height=height)
+
+
+def _budget(pixels):
+    return pixels * 3 * RENDER_MEMORY_FACTOR
+
+
+def test_page_within_budget_is_one_tile():
+    doc, page = _page(100, 100)
+    assert page_tiles(page, pymupdf.Matrix(1, 1), _budget(10000)) == [page.rect]
+
+
+def test_wide_page_is_split_into_full_width_bands():
+    # 400 pixels wide is more than the square root of the budget, but 25 rows fit
+    doc, page = _page(400, 100)
+    tiles = page_tiles(page, pymupdf.Matrix(1, 1), _budget(10000))
+    assert len(tiles) == 4
+    assert all(tile.x0 == 0 and tile.x1 == 400 for tile in tiles)
+    assert tiles[-1].y1 == 100
+
+
+def test_page_wider_than_budget_is_split_into_grid():
+    doc, page = _page(400, 10)
+    tiles = page_tiles(page, pymupdf.Matrix(1, 1), _budget(100))
+    assert all(tile.width * tile.height <= 100 for tile in tiles)
+    assert len({tile.x0 for tile in tiles}) > 1
+    assert sum(tile.width * tile.height for tile in tiles) == 4000
+
+
+def test_tiles_cover_zoomed_page():
+    doc, page = _page(300, 200)
+    tiles = page_tiles(page, pymupdf.Matrix(2, 2), _budget(50000))
+    assert all(tile.x0 == 0 and tile.x1 == 300 for tile in tiles)
+    assert tiles[0].y0 == 0 and tiles[-1].y1 == 200
+    assert all(a.y1 == b.y0 for a, b in zip(tiles, tiles[1:]))
+
+
+def _dark_and_light_document():
+    doc = pymupdf.open()
+    for fill in ((0, 0, 0), (1, 1, 1)):
+        page = doc.new_page(width=200, height=200)
+        page.draw_rect(page.rect, fill=fill)
+    return doc
+
+
+def test_auto_mode_inverts_dark_pages_only():
+    with _dark_and_light_document() as doc, invert_document(doc, "auto") as inverted:
+        assert len(inverted[0].get_images()) == 1
+        assert inverted[1].get_images() == []
+        assert page_luminance(inverted[0]) > 200
+        assert page_luminance(inverted[1]) > 200
+
+
+def test_auto_mode_interprets_each_page_once(monkeypatch):
+    display_lists = []
+    get_displaylist = pymupdf.Page.get_displaylist
+
+    def counting_get_displaylist(page, *args, **kwargs):
+        display_lists.append(page.number)
+        return get_displaylist(page, *args, **kwargs)
+
+    def no_page_render(*args, **kwargs):
+        raise AssertionError("page rendered from its content stream")
+
+    monkeypatch.setattr(pymupdf.Page, "get_displaylist", counting_get_displaylist)
+    monkeypatch.setattr(pymupdf.Page, "get_pixmap", no_page_render)
+    with _dark_and_light_document() as doc:
+        invert_document(doc, "auto").close()
+    assert display_lists == [0, 1]
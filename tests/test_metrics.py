@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from src import metrics
+
+
+def _serve_requests(count):
+    for _ in range(count):
+        metrics.increment("test_requests_total", endpoint="upload")
+        metrics.observe("test_request_seconds", 0.02)
+    metrics.set_gauge("test_open_documents", 3)
+    metrics.set_gauge("test_queue_depth", count)
+    metrics.flush()
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    metrics.describe("test_queue_depth", "Shared queue depth.", merge="latest")
+    return tmp_path
+
+
+def test_render_without_metrics_dir_reports_this_process(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", None)
+    metrics.increment("test_local_total", endpoint="upload")
+    assert 'test_local_total{endpoint="upload"} 1' in metrics.render_prometheus().splitlines()
+
+
+def _snapshot_gauges(metrics_dir):
+    gauges = {}
+    for filename in os.listdir(metrics_dir):
+        if filename.endswith(".json"):
+            with open(os.path.join(metrics_dir, filename)) as f:
+                gauges.update({name: value for name, labels, value, updated in json.load(f)["gauges"]})
+    return gauges
+
+
+def test_requests_do_not_write_metrics(metrics_dir):
+    metrics.begin_request()
+    metrics.increment("test_unwritten_total")
+    metrics.end_request()
+    assert os.listdir(metrics_dir) == []
+
+
+def test_flusher_writes_requests_in_flight(metrics_dir, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setitem(metrics._process, "flusher_pid", None)
+    metrics.begin_request()
+    metrics.add_gauge("test_in_flight", 1)
+    try:
+        deadline = time.monotonic() + 5
+        while _snapshot_gauges(metrics_dir).get("test_in_flight") != 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert _snapshot_gauges(metrics_dir).get("test_in_flight") == 1
+    finally:
+        metrics.add_gauge("test_in_flight", -1)
+        metrics.end_request()
+
+
+def test_render_sums_all_worker_processes(metrics_dir):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_serve_requests, args=(count,)) for count in (2, 5)]
+    for worker in workers:
+        worker.start()
+        worker.join(10)
+
+    output = metrics.render_prometheus()
+    assert 'test_requests_total{endpoint="upload"} 7' in output
+    assert "test_request_seconds_count 7" in output
+    assert 'test_request_seconds_bucket{le="0.025"} 7' in output
+    # Workers have exited: their counters stay, their gauges are dropped
+    assert "test_open_documents" not in output
+    assert len(os.listdir(metrics_dir)) == 3
+
+
+def test_gauges_of_live_workers_are_merged(metrics_dir):
+    context = multiprocessing.get_context("fork")
+    release = context.Event()
+
+    def serve(count, flushed):
+        _serve_requests(count)
+        flushed.set()
+        release.wait(10)
+
+    workers = []
+    try:
+        # One after the other, so the second worker sets the shared gauge last
+        for count in (5, 2):
+            flushed = context.Event()
+            workers.append(context.Process(target=serve, args=(count, flushed)))
+            workers[-1].start()
+            assert flushed.wait(10)
+        output = metrics.render_prometheus()
+    finally:
+        release.set()
+        for worker in workers:
+            worker.join(10)
+
+    assert "test_open_documents 6" in output
+    assert "test_queue_depth 2" in output
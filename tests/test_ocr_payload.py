@@ -0,0 +1,52 @@
+import numpy as np
+import pymupdf
+import pytest
+
+from src import metrics
+from src.ocr_payload import prepare_ocr_payload, select_pages
+
+
+def _scanned_pdf(path, pages=2):
+    # A noisy 2400px image on a 3 inch page is 800 dpi, well above the OCR target
+    samples = np.random.default_rng(0).integers(0, 256, (2400, 2400, 3), dtype=np.uint8)
+    image = pymupdf.Pixmap(pymupdf.csRGB, 2400, 2400, samples.tobytes(), False)
+    with pymupdf.open() as doc:
+        for number in range(pages):
+            page = doc.new_page(width=216, height=216)
+            page.insert_image(page.rect, pixmap=image)
+            page.insert_text((20, 20), "Invoice total" if number == 1 else "Terms")
+        doc.save(path)
+    return path
+
+
+@pytest.fixture
+def request_details():
+    metrics.begin_request()
+    yield metrics.request_details
+    metrics.end_request()
+
+
+def test_payload_is_reduced_and_logged(tmp_path, request_details):
+    path = _scanned_pdf(str(tmp_path / "scan.pdf"))
+    payload = prepare_ocr_payload(path)
+
+    details = request_details()
+    assert details["ocr_payload_bytes"] == len(payload)
+    assert details["ocr_payload_bytes"] < details["ocr_original_bytes"] / 2
+    assert details["ocr_bytes_saved"] == details["ocr_original_bytes"] - len(payload)
+    assert details["ocr_pages"] == details["ocr_total_pages"] == 2
+    with pymupdf.open(stream=payload, filetype="pdf") as doc:
+        assert doc.page_count == 2
+
+
+def test_details_of_several_documents_are_summed(tmp_path, request_details):
+    first = len(prepare_ocr_payload(_scanned_pdf(str(tmp_path / "a.pdf"), pages=1)))
+    second = len(prepare_ocr_payload(_scanned_pdf(str(tmp_path / "b.pdf"), pages=2)))
+    assert request_details()["ocr_payload_bytes"] == first + second
+    assert request_details()["ocr_total_pages"] == 3
+
+
+def test_pages_mentioning_requested_fields_are_selected(tmp_path):
+    with pymupdf.open(_scanned_pdf(str(tmp_path / "scan.pdf"), pages=3)) as doc:
+        assert select_pages(doc, ["Total"], max_pages=1) == [1]
+        assert select_pages(doc, None, max_pages=1) == [0, 1, 2]
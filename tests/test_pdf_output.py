@@ -0,0 +1,61 @@
+import os
+
+import pymupdf
+import pytest
+
+from src.pdf_output import save_pdf, SAVE_PRESETS
+
+
+def _document():
+    doc = pymupdf.open()
+    for number in range(5):
+        page = doc.new_page()
+        # An embedded font, so subsetting has something to remove
+        page.insert_font(fontname="noto", fontbuffer=pymupdf.Font("tiro").buffer)
+        page.insert_text((72, 72), f"Page {number + 1} " + "text " * 200, fontname="noto")
+    return doc
+
+
+def _font_bytes(doc):
+    return sum(len(doc.extract_font(xref)[3]) for page in doc for xref, *_ in page.get_fonts())
+
+
+@pytest.mark.parametrize("preset", sorted(SAVE_PRESETS))
+def test_every_preset_writes_a_readable_pdf(tmp_path, preset):
+    path = str(tmp_path / f"{preset}.pdf")
+    with _document() as doc:
+        save_pdf(doc, path, preset)
+    with pymupdf.open(path) as saved:
+        assert saved.page_count == 5
+
+
+def test_compressing_presets_are_smaller(tmp_path):
+    sizes = {}
+    for preset in ("fast", "balanced"):
+        path = str(tmp_path / f"{preset}.pdf")
+        with _document() as doc:
+            save_pdf(doc, path, preset)
+        sizes[preset] = os.path.getsize(path)
+    assert sizes["balanced"] < sizes["fast"]
+
+
+def test_unknown_preset_is_rejected(tmp_path):
+    with _document() as doc, pytest.raises(ValueError, match="Unknown preset"):
+        save_pdf(doc, str(tmp_path / "out.pdf"), "web")
+    assert not os.path.exists(tmp_path / "out.pdf")
+
+
+def test_smallest_subsets_fonts(tmp_path):
+    with _document() as doc:
+        before = _font_bytes(doc)
+        save_pdf(doc, str(tmp_path / "smallest.pdf"), "smallest")
+    with pymupdf.open(str(tmp_path / "smallest.pdf")) as saved:
+        assert _font_bytes(saved) < before
+
+
+def test_smallest_keeps_session_document_unchanged(tmp_path):
+    with _document() as doc:
+        before = _font_bytes(doc)
+        save_pdf(doc, str(tmp_path / "smallest.pdf"), "smallest", keep_document=True)
+        assert _font_bytes(doc) == before
+        assert doc.page_count == 5
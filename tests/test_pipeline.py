@@ -0,0 +1,98 @@
+import pymupdf
+import pytest
+
+from src.pipeline import plan_pipeline, run_pipeline
+from src.operations import validate_operation
+
+
+def redact(page, fill=None):
+    op = {'operation': 'redact', 'redactions': [{'page': page, 'x': 0, 'y': 0, 'width': 10, 'height': 10}]}
+    if fill is not None:
+        op['fill'] = fill
+    return op
+
+
+@pytest.mark.parametrize('pages', ['0', '-1', '0-2', '5-3', '', 'a', '1-2-3'])
+def test_invalid_page_selections_are_rejected(pages):
+    with pytest.raises(ValueError):
+        validate_operation({'operation': 'remove', 'pages': pages})
+
+
+def test_page_zero_in_later_remove_is_rejected():
+    # Used to loop forever while renumbering against the earlier removal
+    with pytest.raises(ValueError):
+        plan_pipeline([{'operation': 'remove', 'pages': '2'}, {'operation': 'remove', 'pages': '0'}])
+
+
+def test_page_zero_remove_does_not_shift_redactions():
+    with pytest.raises(ValueError):
+        plan_pipeline([redact(1), {'operation': 'remove', 'pages': '0'}])
+
+
+def test_negative_redaction_page_is_rejected():
+    with pytest.raises(ValueError):
+        plan_pipeline([redact(-1)])
+
+
+def test_consecutive_removes_are_merged_in_original_numbering():
+    steps, _ = plan_pipeline([{'operation': 'remove', 'pages': '2'}, {'operation': 'remove', 'pages': '2'}])
+    assert steps == [{'operation': 'remove', 'pages': '2,3'}]
+
+
+def test_remove_moves_before_invert_and_renumbers_redactions():
+    steps, _ = plan_pipeline([
+        redact(3),
+        {'operation': 'invert'},
+        {'operation': 'remove', 'pages': '1-2'},
+    ])
+    assert [step['operation'] for step in steps] == ['remove', 'redact', 'invert']
+    assert steps[0]['pages'] == '1,2'
+    assert steps[1]['redactions'][0]['page'] == 1
+
+
+def test_redactions_on_removed_pages_are_dropped():
+    steps, _ = plan_pipeline([redact(0), {'operation': 'remove', 'pages': '1'}])
+    assert steps == [{'operation': 'remove', 'pages': '1'}]
+
+
+def test_redact_after_full_invert_moves_before_it_with_inverted_fill():
+    steps, _ = plan_pipeline([{'operation': 'invert'}, redact(0, fill=[0, 0, 0])])
+    assert [step['operation'] for step in steps] == ['redact', 'invert']
+    assert steps[0]['fill'] == [1, 1, 1]
+
+
+def test_double_full_invert_cancels():
+    steps, _ = plan_pipeline([{'operation': 'invert'}, {'operation': 'invert'}])
+    assert steps == []
+
+
+def test_auto_inverts_do_not_cancel():
+    steps, _ = plan_pipeline([{'operation': 'invert', 'mode': 'auto'}, {'operation': 'invert', 'mode': 'auto'}])
+    assert len(steps) == 2
+
+
+def test_optimize_selects_preset():
+    steps, preset = plan_pipeline([{'operation': 'optimize', 'preset': 'smallest'}])
+    assert steps == [] and preset == 'smallest'
+
+
+def test_unknown_operation_is_rejected():
+    with pytest.raises(ValueError):
+        plan_pipeline([{'operation': 'explode'}])
+
+
+def test_run_pipeline_removes_pages(tmp_path):
+    source = tmp_path / 'in.pdf'
+    doc = pymupdf.open()
+    for number in range(5):
+        doc.new_page().insert_text((72, 72), f'page {number + 1}')
+    doc.save(source)
+    doc.close()
+
+    output = tmp_path / 'out.pdf'
+    run_pipeline(str(source), str(output), [
+        {'operation': 'remove', 'pages': '2'},
+        {'operation': 'remove', 'pages': '3'},
+    ])
+    with pymupdf.open(output) as result:
+        assert [page.get_text().strip() for page in result] == ['page 1', 'page 3', 'page 5']
@@ -0,0 +1,75 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import pymupdf
+import pytest
+
+from src import profiling
+
+
+@profiling.profiled("test")
+def _allocate(input_pdf_path, megabytes, started=None, release=None):
+    buffers = [bytearray(1024 * 1024) for _ in range(megabytes)]
+    if started is not None:
+        started.set()
+        release.wait(10)
+    return len(buffers)
+
+
+def _profile_request(*args, **kwargs):
+    profiling._enabled.set(True)
+    try:
+        return _allocate(*args, **kwargs)
+    finally:
+        profiling.end_request()
+
+
+def _peaks(folder):
+    peaks = []
+    for path in glob.glob(os.path.join(folder, "*.json")):
+        with open(path) as f:
+            peaks.append(json.load(f)["tracemalloc_peak_bytes"] // (1024 * 1024))
+    return sorted(peaks)
+
+
+@pytest.fixture
+def input_pdf_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_FOLDER", str(tmp_path / "profiles"))
+    path = str(tmp_path / "input.pdf")
+    with pymupdf.open() as doc:
+        doc.new_page()
+        doc.save(path)
+    return path
+
+
+def test_profile_records_peak_memory(tmp_path, input_pdf_path):
+    _profile_request(input_pdf_path, 8)
+    peak, = _peaks(tmp_path / "profiles")
+    assert 8 <= peak < 11
+
+
+def test_concurrent_call_runs_unprofiled_without_waiting(tmp_path, input_pdf_path):
+    started, release = threading.Event(), threading.Event()
+    first = threading.Thread(target=_profile_request, args=(input_pdf_path, 16, started, release))
+    first.start()
+    try:
+        assert started.wait(10)
+        start = time.perf_counter()
+        assert _profile_request(input_pdf_path, 4) == 4
+        assert time.perf_counter() - start < 1
+    finally:
+        release.set()
+        first.join(10)
+
+    # Only the first call was profiled; tracemalloc also saw the unprofiled call
+    peak, = _peaks(tmp_path / "profiles")
+    assert 16 <= peak < 16 + 4 + 3
+
+
+def test_profiles_taken_back_to_back_are_kept(tmp_path, input_pdf_path):
+    for _ in range(3):
+        _profile_request(input_pdf_path, 1)
+    assert len(_peaks(tmp_path / "profiles")) == 3
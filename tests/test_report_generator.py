@@ -0,0 +1,55 @@
+import os
+
+import pymupdf
+import pytest
+
+from src.report_generator import build_reports, ReportJob
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "report.html"
+    path.write_text("<h1>{{ title }}</h1><p>{{ body }}</p>")
+    return str(path)
+
+
+def _jobs(count, changed=None):
+    return [ReportJob(f"report_{n}.pdf", {"title": f"Report {n}", "body": "changed" if n == changed else "text"})
+            for n in range(count)]
+
+
+def test_reports_are_built_from_template(tmp_path, template):
+    summary = build_reports(template, _jobs(3), str(tmp_path / "out"), workers=1)
+    assert (summary["built"], summary["failed"]) == (3, 0)
+    with pymupdf.open(str(tmp_path / "out" / "report_2.pdf")) as doc:
+        assert "Report 2" in doc[0].get_text()
+
+
+def test_only_changed_reports_are_rebuilt(tmp_path, template):
+    build_reports(template, _jobs(3), str(tmp_path / "out"), workers=2)
+    summary = build_reports(template, _jobs(3, changed=1), str(tmp_path / "out"), workers=2)
+    assert (summary["built"], summary["skipped"]) == (1, 2)
+
+    os.remove(tmp_path / "out" / "report_0.pdf")
+    summary = build_reports(template, _jobs(3, changed=1), str(tmp_path / "out"), workers=1)
+    assert (summary["built"], summary["skipped"]) == (1, 2)
+
+
+def test_template_change_rebuilds_everything(tmp_path, template):
+    build_reports(template, _jobs(2), str(tmp_path / "out"), workers=1)
+    with open(template, "a") as f:
+        f.write("<p>Footer</p>")
+    assert build_reports(template, _jobs(2), str(tmp_path / "out"), workers=1)["built"] == 2
+
+
+def test_failed_report_is_reported_and_retried(tmp_path, template):
+    jobs = _jobs(1) + [ReportJob("broken.pdf", {}, template=str(tmp_path / "broken.html"))]
+    (tmp_path / "broken.html").write_text("{{ undefined_call() }}")
+    summary = build_reports(template, jobs, str(tmp_path / "out"), workers=1)
+    assert list(summary["errors"]) == ["broken.pdf"]
+    assert build_reports(template, jobs, str(tmp_path / "out"), workers=1)["skipped"] == 1
+
+
+def test_unknown_backend_is_rejected(tmp_path, template):
+    with pytest.raises(ValueError, match="Unknown backend"):
+        build_reports(template, _jobs(1), str(tmp_path / "out"), backend="weasyprint")
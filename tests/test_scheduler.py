@@ -0,0 +1,110 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import pymupdf
+import pytest
+
+from src.scheduler import (
+    AdmissionScheduler, AdmissionRejected, JobCost, estimate_document_cost,
+    estimate_open_document_render_cost, DOCUMENT_BYTES_PER_SECOND, RENDER_PIXELS_PER_SECOND,
+)
+
+
+def _hold_job(state_dir, admitted, release):
+    scheduler = AdmissionScheduler(memory_budget=100, max_jobs=1, state_dir=state_dir)
+    with scheduler.admit(JobCost(10, 1)):
+        admitted.set()
+        release.wait(10)
+
+
+@pytest.fixture
+def worker(tmp_path):
+    """A second process holding the only job slot until released"""
+    context = multiprocessing.get_context("fork")
+    admitted, release = context.Event(), context.Event()
+    process = context.Process(target=_hold_job, args=(str(tmp_path), admitted, release))
+    process.start()
+    assert admitted.wait(10)
+    yield release
+    release.set()
+    process.join(10)
+
+
+def test_job_slots_are_shared_across_processes(tmp_path, worker):
+    scheduler = AdmissionScheduler(memory_budget=100, max_jobs=1, queue_timeout=0.2, state_dir=str(tmp_path))
+    with pytest.raises(AdmissionRejected):
+        with scheduler.admit(JobCost(10, 1)):
+            pass
+
+    worker.set()
+    scheduler.queue_timeout = 10
+    with scheduler.admit(JobCost(10, 1)):
+        pass
+
+
+def test_memory_budget_is_shared_across_processes(tmp_path, worker):
+    scheduler = AdmissionScheduler(memory_budget=100, max_jobs=4, queue_timeout=0.2, state_dir=str(tmp_path))
+    with scheduler.admit(JobCost(90, 1)):
+        pass
+    # 10 bytes are held by the other process, so a 95 byte job has to wait
+    with pytest.raises(AdmissionRejected):
+        with scheduler.admit(JobCost(95, 1)):
+            pass
+
+
+def test_queue_is_shared_across_processes(tmp_path, worker):
+    scheduler = AdmissionScheduler(max_jobs=1, queue_timeout=0.2, max_queue=1, state_dir=str(tmp_path))
+    with open(os.path.join(tmp_path, "ledger.json")) as f:
+        ledger = json.load(f)
+    ledger["waiting"]["other"] = {"pid": os.getppid(), "work": 1, "memory": 1, "sequence": 0}
+    with open(os.path.join(tmp_path, "ledger.json"), "w") as f:
+        json.dump(ledger, f)
+
+    with pytest.raises(AdmissionRejected, match="busy"):
+        with scheduler.admit(JobCost(1, 1)):
+            pass
+
+
+def test_jobs_of_dead_processes_are_released(tmp_path):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with open(os.path.join(tmp_path, "ledger.json"), "w") as f:
+        json.dump({"running": {"lost": {"pid": dead.pid, "memory": 100}}, "waiting": {}, "sequence": 0}, f)
+
+    scheduler = AdmissionScheduler(memory_budget=100, max_jobs=1, queue_timeout=0.2, state_dir=str(tmp_path))
+    start = time.monotonic()
+    with scheduler.admit(JobCost(100, 1)):
+        pass
+    assert time.monotonic() - start < 0.2
+
+
+def test_render_and_structural_costs_are_both_in_seconds():
+    assert estimate_document_cost(DOCUMENT_BYTES_PER_SECOND).work == pytest.approx(1.0)
+    with pymupdf.open() as doc:
+        for _ in range(10):
+            doc.new_page(width=500, height=600)
+        cost = estimate_open_document_render_cost(doc, 0, zoom=2)
+    assert cost.work == pytest.approx(10 * 1000 * 1200 / RENDER_PIXELS_PER_SECOND)
+
+
+def test_waiting_does_not_rewrite_unchanged_ledger(tmp_path, worker, monkeypatch):
+    scheduler = AdmissionScheduler(max_jobs=1, queue_timeout=0.5, poll_interval=0.01, state_dir=str(tmp_path))
+    ledger_path = os.path.join(tmp_path, "ledger.json")
+    writes = []
+    real_replace = os.replace
+
+    def counting_replace(src, dst):
+        if dst == ledger_path:
+            writes.append(dst)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", counting_replace)
+    with pytest.raises(AdmissionRejected):
+        with scheduler.admit(JobCost(1, 1)):
+            pass
+    # Queued and removed again, despite about 50 polls in between
+    assert len(writes) == 2
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from src import structuring
+from src.structuring import split_markdown, merge_values, merge_partials, missing_fields
+
+# The extraction module creates its Mistral client at import time
+os.environ.setdefault("MISTRAL_API_KEY", "test")
+from src import extract_data  # noqa: E402
+
+
+def _run(plan, respond):
+    """Drives a plan_structuring generator, answering each prompt with respond(prompt)"""
+    waves = []
+    try:
+        prompts = next(plan)
+        while True:
+            waves.append(prompts)
+            prompts = plan.send([respond(prompt) for prompt in prompts])
+    except StopIteration as done:
+        return done.value, waves
+
+
+def _page(number):
+    return f"Page {number} " + "x" * 80
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # One page per chunk, two chunks per wave
+    monkeypatch.setattr(structuring, "STRUCTURE_CHUNK_CHARS", 100)
+    monkeypatch.setattr(extract_data, "STRUCTURE_CONCURRENCY", 2)
+
+
+def test_pages_are_packed_and_long_pages_split():
+    assert split_markdown(["a" * 10, "b" * 10, "c" * 10], max_chars=25) == ["a" * 10 + "\n\n" + "b" * 10, "c" * 10]
+    assert split_markdown(["one\n\ntwo\n\nthree"], max_chars=9) == ["one", "two", "three"]
+    assert split_markdown([]) == [""]
+
+
+@pytest.mark.parametrize("current, new, merged", [
+    ("", "5", "5"),
+    ("5", None, "5"),
+    ("5", "7", "5"),
+    (["a", "b"], ["b", "c"], ["a", "b", "c"]),
+    ({"city": "Paris"}, {"city": "Lyon", "zip": "75001"}, {"city": "Paris", "zip": "75001"}),
+])
+def test_merge_rules(current, new, merged):
+    assert merge_values(current, new) == merged
+
+
+def test_partial_keys_are_mapped_onto_requested_fields():
+    merged = merge_partials([{"invoice_number": "", "TOTAL": "5"}, {"Invoice Number": "42"}, "not a dict"],
+                            ["Invoice Number", "Total", "Date"])
+    assert merged == {"Invoice Number": "42", "Total": "5", "Date": ""}
+    assert missing_fields(merged, ["Invoice Number", "Total", "Date"]) == ["Date"]
+
+
+def test_requested_fields_stop_structuring_once_found():
+    def respond(prompt):
+        if "Page 1 " in prompt:
+            return {"Total": "5", "Date": ""}
+        if "Page 3 " in prompt:
+            return {"Total": "9", "Date": "2024-01-01"}
+        return {}
+
+    pages = [_page(number) for number in range(1, 8)]
+    result, waves = _run(extract_data.plan_structuring(pages, ["Total", "Date"]), respond)
+    # The earlier page wins the conflicting Total; pages 5 to 7 are never sent
+    assert result == {"Total": "5", "Date": "2024-01-01"}
+    assert [len(wave) for wave in waves] == [2, 2]
+    # The second wave only asks for what is still missing
+    assert "Extract the following fields: Date." in waves[1][0]
+
+
+def test_later_chunks_reuse_keys_of_first_chunk():
+    def respond(prompt):
+        if "Page 1 " in prompt:
+            return {"vendor": "ACME", "items": ["a"]}
+        return {"items": ["a", "b"], "vendor": "Other"}
+
+    pages = [_page(number) for number in range(1, 4)]
+    result, waves = _run(extract_data.plan_structuring(pages), respond)
+    assert result == {"vendor": "ACME", "items": ["a", "b"]}
+    assert [len(wave) for wave in waves] == [1, 2]
+    assert "use these keys: vendor, items" in waves[1][0]
+
+
+def test_failed_chunks_are_skipped_unless_all_fail():
+    pages = [_page(number) for number in range(1, 3)]
+
+    def partly_failing(prompt):
+        return ValueError("bad json") if "Page 1 " in prompt else {"Total": "5"}
+
+    result, _ = _run(extract_data.plan_structuring(pages, ["Total"]), partly_failing)
+    assert result == {"Total": "5"}
+
+    with pytest.raises(ValueError, match="bad json"):
+        _run(extract_data.plan_structuring(pages, ["Total"]), lambda prompt: ValueError("bad json"))
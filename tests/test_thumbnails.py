@@ -0,0 +1,54 @@
+import io
+import os
+
+import pymupdf
+import pytest
+
+# The app creates its Mistral client at import time
+os.environ.setdefault("MISTRAL_API_KEY", "test")
+import app as flask_app  # noqa: E402
+
+
+def _pdf_bytes(pages=5):
+    with pymupdf.open() as doc:
+        for number in range(pages):
+            doc.new_page(width=300 + number, height=400).insert_text((72, 72), f"Page {number + 1}")
+        return doc.tobytes()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(flask_app, "PREVIEW_FOLDER", str(tmp_path))
+    return flask_app.app.test_client()
+
+
+@pytest.fixture
+def token(client):
+    response = client.post("/upload-for-redaction", data={"file": (io.BytesIO(_pdf_bytes()), "doc.pdf")})
+    return response.get_json()["filename"]
+
+
+def test_pages_are_listed_in_ranges(client, token):
+    data = client.get(f"/pages/{token}?start=1&end=2").get_json()
+    assert data["page_count"] == 5
+    assert [(page["page"], page["width"]) for page in data["pages"]] == [(1, 301), (2, 302)]
+    assert data["pages"][0]["thumbnail"] == f"/thumbnail/{token}/1"
+
+
+@pytest.mark.parametrize("width", [100, 200])
+def test_thumbnail_is_rendered_at_requested_width(client, token, width):
+    response = client.get(f"/thumbnail/{token}/0?width={width}")
+    assert response.headers["Content-Type"] == "image/png"
+    assert pymupdf.Pixmap(response.data).width == width
+
+
+def test_missing_page_and_unknown_token_are_not_found(client, token):
+    assert client.get(f"/thumbnail/{token}/5").status_code == 404
+    assert client.get("/pages/doc.pdf").status_code == 404
+    assert client.get(f"/pages/{'0' * 32}").status_code == 404
+
+
+def test_edit_pages_uses_preview_endpoints(client):
+    html = client.get("/edit-pages").get_data(as_text=True)
+    assert "/upload-for-redaction" in html
+    assert "/pages/" in html and "/thumbnail/" in html